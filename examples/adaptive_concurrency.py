@@ -0,0 +1,102 @@
+from lithops.concurrency import ConcurrencyController
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
+import random
+import queue
+import time
+import uuid
+
+
+class RateLimitedBackend:
+    """
+    Compute backend that accepts up to `rate` invocations per second, with
+    bursts of up to `burst`, and rejects the rest, as a 429 response
+    """
+    def __init__(self, rate, burst, latency):
+        self.rate = rate
+        self.burst = burst
+        self.latency = latency
+        self.tokens = burst
+        self.last_refill = time.time()
+        self.rejections = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, runtime_name, runtime_memory, payload):
+        time.sleep(self.latency)
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens < 1:
+                self.rejections += 1
+                return None
+            self.tokens -= 1
+        return uuid.uuid4().hex
+
+
+def run(backend, calls, threads, concurrency=None):
+    """
+    Invokes all the calls from a pool of threads, as an invoker process does.
+    Rejected calls are queued again, after a random sleep of up to 5 seconds
+    without a concurrency controller.
+    """
+    pending_calls = queue.Queue()
+    for i in range(calls):
+        pending_calls.put(i)
+    done = threading.Semaphore(0)
+
+    def invoke(call_id):
+        if concurrency:
+            concurrency.acquire()
+        start = time.time()
+        activation_id = backend.invoke('runtime', 256, {'call_id': call_id})
+        if concurrency:
+            concurrency.release(not activation_id, time.time() - start)
+        if activation_id:
+            done.release()
+            return
+        if not concurrency:
+            time.sleep(random.randint(0, 5))
+        pending_calls.put(call_id)
+
+    t0 = time.time()
+    with ThreadPoolExecutor(threads) as executor:
+        def consume():
+            while True:
+                call_id = pending_calls.get()
+                if call_id is None:
+                    break
+                executor.submit(invoke, call_id)
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        for _ in range(calls):
+            done.acquire()
+        pending_calls.put(None)
+
+    return time.time() - t0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Adaptive concurrency against a rate limited backend')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help='Accepted invocations per second')
+    parser.add_argument('--burst', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='Invocation request latency in seconds')
+    parser.add_argument('--threads', type=int, default=250)
+    args = parser.parse_args()
+
+    print('{} calls - Rate limit: {}/s - Burst: {} - Latency: {}s - Ideal: {:.2f}s'
+          .format(args.calls, args.rate, args.burst, args.latency, (args.calls - args.burst) / args.rate))
+
+    backend = RateLimitedBackend(args.rate, args.burst, args.latency)
+    elapsed = run(backend, args.calls, args.threads)
+    print('  random sleep - {:.2f}s - {:.0f} invokes/sec - {} rejections'
+          .format(elapsed, args.calls / elapsed, backend.rejections))
+
+    backend = RateLimitedBackend(args.rate, args.burst, args.latency)
+    concurrency = ConcurrencyController(max_limit=args.threads)
+    elapsed = run(backend, args.calls, args.threads, concurrency)
+    print('  adaptive     - {:.2f}s - {:.0f} invokes/sec - {} rejections - {}'
+          .format(elapsed, args.calls / elapsed, backend.rejections, concurrency.metrics()))
@@ -0,0 +1,51 @@
+from lithops.job.compression import CODECS, compress, decompress
+import argparse
+import pickle
+import json
+import time
+import os
+
+
+def compressible_data(n):
+    return [json.dumps({'id': i, 'name': 'user-{}'.format(i % 100), 'tags': ['a', 'b', 'c'] * 10,
+                        'text': 'lorem ipsum dolor sit amet ' * 20}) for i in range(n)]
+
+
+def incompressible_data(n):
+    return [os.urandom(1024) for _ in range(n)]
+
+
+def benchmark(name, data, bandwidth):
+    """
+    Compresses each element on its own, as the job data is uploaded, and
+    compares the estimated upload plus download time against the raw data
+    """
+    data_strs = [pickle.dumps(x) for x in data]
+    raw_size = sum(len(x) for x in data_strs)
+    raw_time = 2 * raw_size / bandwidth
+    print('{} data - {} elements - {:.2f}MB'.format(name, len(data_strs), raw_size / 1024**2))
+
+    for codec in CODECS:
+        t0 = time.time()
+        compressed = [compress(x, codec) for x in data_strs]
+        compress_time = time.time() - t0
+        t0 = time.time()
+        for x in compressed:
+            decompress(x, codec)
+        decompress_time = time.time() - t0
+        size = sum(len(x) for x in compressed)
+        total_time = compress_time + 2 * size / bandwidth + decompress_time
+        print('  {:5} - Ratio: {:5.2f} - Compress: {:.3f}s - Decompress: {:.3f}s - '
+              'Speedup: {:.2f}x'.format(codec, raw_size / size, compress_time, decompress_time,
+                                        raw_time / total_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Job data compression benchmark')
+    parser.add_argument('--elements', type=int, default=10000)
+    parser.add_argument('--bandwidth', type=float, default=50, help='Storage bandwidth in MB/s')
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth * 1024**2
+    benchmark('Compressible', compressible_data(args.elements), bandwidth)
+    benchmark('Incompressible', incompressible_data(args.elements), bandwidth)
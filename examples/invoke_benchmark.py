@@ -0,0 +1,81 @@
+from lithops.async_invoker import AsyncInvoker
+from concurrent.futures import ThreadPoolExecutor, wait
+import argparse
+import asyncio
+import time
+import uuid
+
+
+class MockComputeHandler:
+    """
+    Compute backend that accepts every invocation after a fixed latency.
+    The sync invoke opens a new connection per call, as the OpenWhisk client
+    does, so it pays the connection setup every time. invoke_async takes a
+    connection of the pool, and only pays the setup the first time each
+    connection is used.
+    """
+    def __init__(self, latency, handshake, pool_size):
+        self.latency = latency
+        self.handshake = handshake
+        self.pool_size = pool_size
+        self.pool = None
+
+    def invoke(self, runtime_name, runtime_memory, payload):
+        time.sleep(self.handshake + self.latency)
+        return uuid.uuid4().hex
+
+    async def invoke_async(self, session, runtime_name, runtime_memory, payload):
+        if self.pool is None:
+            self.pool = asyncio.Queue()
+            for _ in range(self.pool_size):
+                self.pool.put_nowait(False)
+        connected = await self.pool.get()
+        if not connected:
+            await asyncio.sleep(self.handshake)
+        await asyncio.sleep(self.latency)
+        self.pool.put_nowait(True)
+        return uuid.uuid4().hex
+
+
+def benchmark_threads(compute_handler, calls, threads):
+    """
+    A new pool of threads per job, as the threads invoke engine does
+    """
+    t0 = time.time()
+    executor = ThreadPoolExecutor(threads)
+    futures = [executor.submit(compute_handler.invoke, 'runtime', 256, {'call_id': i}) for i in range(calls)]
+    wait(futures)
+    elapsed = time.time() - t0
+    executor.shutdown()
+    return calls / elapsed
+
+
+def benchmark_asyncio(compute_handler, calls, max_inflight, pool_size):
+    async_invoker = AsyncInvoker(compute_handler, max_inflight=max_inflight, pool_size=pool_size)
+    t0 = time.time()
+    futures = [async_invoker.submit(async_invoker.invoke('runtime', 256, {'call_id': i})) for i in range(calls)]
+    wait(futures)
+    elapsed = time.time() - t0
+    async_invoker.stop()
+    return calls / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Function invocation throughput benchmark')
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Invocation request latency in seconds')
+    parser.add_argument('--handshake', type=float, default=0.05, help='Connection setup time in seconds')
+    parser.add_argument('--threads', type=int, default=128, help='invoke_pool_threads of the threads engine')
+    parser.add_argument('--max-inflight', type=int, default=1000)
+    parser.add_argument('--pool-size', type=int, default=100)
+    args = parser.parse_args()
+
+    compute_handler = MockComputeHandler(args.latency, args.handshake, args.pool_size)
+    print('{} calls - Latency: {}s - Connection setup: {}s'.format(args.calls, args.latency, args.handshake))
+
+    rate = benchmark_threads(compute_handler, args.calls, args.threads)
+    print('  threads - {} threads - {:.0f} invokes/sec'.format(args.threads, rate))
+
+    rate = benchmark_asyncio(compute_handler, args.calls, args.max_inflight, args.pool_size)
+    print('  asyncio - {} in flight, {} connections - {:.0f} invokes/sec'
+          .format(args.max_inflight, args.pool_size, rate))
@@ -0,0 +1,156 @@
+#
+# (C) Copyright IBM Corp. 2020
+# (C) Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import queue
+import asyncio
+import logging
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+INVOKE_MAX_INFLIGHT = 1000
+INVOKE_POOL_SIZE = 100
+INVOKE_KEEPALIVE = 30
+
+
+class AsyncInvoker:
+    """
+    Runs the invocations of a ServerlessInvoker as coroutines of an asyncio
+    event loop, in a background thread. At most max_inflight invocations are
+    in flight at once, or as many as the slots of the inflight semaphore,
+    shared with the async invokers of other threads and processes. Backends
+    with an invoke_async method share a pool of pool_size keep-alive
+    connections; the others are invoked from a single pool of pool_size threads.
+    """
+
+    def __init__(self, compute_handler, max_inflight=INVOKE_MAX_INFLIGHT, pool_size=INVOKE_POOL_SIZE,
+                 inflight=None):
+        self.compute_handler = compute_handler
+        self.max_inflight = max_inflight
+        self.pool_size = pool_size
+        self.inflight = inflight
+
+        backend = getattr(compute_handler, 'backend', compute_handler)
+        self.invoke_async = getattr(backend, 'invoke_async', None) if aiohttp else None
+        self.executor = None if self.invoke_async else ThreadPoolExecutor(max_workers=pool_size)
+        self.session = None
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+        # A single thread waits for the shared slots, in the order they are requested
+        self.waiters = queue.Queue()
+        self.waiter_thread = None
+        if self.inflight is not None:
+            self.waiter_thread = Thread(target=self._wait_inflight, daemon=True)
+            self.waiter_thread.start()
+
+        logger.debug('Async invoker started - Max in-flight: {} - Pool size: {} - Connections: {}'
+                     .format(max_inflight, pool_size, 'keep-alive' if self.invoke_async else 'threads'))
+
+    async def _start(self):
+        self.semaphore = asyncio.Semaphore(self.max_inflight) if self.inflight is None else None
+        if self.invoke_async:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=INVOKE_KEEPALIVE)
+            self.session = aiohttp.ClientSession(connector=connector)
+
+    async def invoke(self, runtime_name, runtime_memory, payload):
+        """
+        Invokes a function once an in-flight slot is free. Returns the
+        activation id, or None if the quota limit was reached.
+        """
+        if self.semaphore:
+            async with self.semaphore:
+                return await self._invoke(runtime_name, runtime_memory, payload)
+
+        # Waits for a shared slot from the waiter thread, without blocking the event loop
+        if not self.inflight.acquire(False):
+            waiter = self.loop.create_future()
+            self.waiters.put(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if not waiter.cancelled():
+                    self.inflight.release()
+                raise
+        try:
+            return await self._invoke(runtime_name, runtime_memory, payload)
+        finally:
+            self.inflight.release()
+
+    def _wait_inflight(self):
+        """
+        Acquires the shared slots requested by the invocations, one at a time,
+        and hands each one to its invocation in the event loop
+        """
+        while True:
+            waiter = self.waiters.get()
+            if waiter is None:
+                return
+            if waiter.cancelled():
+                continue
+            self.inflight.acquire()
+            self.loop.call_soon_threadsafe(self._grant_inflight, waiter)
+
+    def _grant_inflight(self, waiter):
+        # The slot of an invocation cancelled while it waited is given back
+        if waiter.cancelled():
+            self.inflight.release()
+        else:
+            waiter.set_result(None)
+
+    async def _invoke(self, runtime_name, runtime_memory, payload):
+        if self.invoke_async:
+            return await self.invoke_async(self.session, runtime_name, runtime_memory, payload)
+        return await self.loop.run_in_executor(self.executor, self.compute_handler.invoke,
+                                               runtime_name, runtime_memory, payload)
+
+    def submit(self, coro):
+        """
+        Schedules a coroutine in the event loop from any thread.
+        Returns a concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        """
+        Waits for the invocations in flight, then closes the connections
+        and stops the event loop
+        """
+        async def _stop():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.session:
+                await self.session.close()
+
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(_stop(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        if self.waiter_thread:
+            self.waiters.put(None)
+            self.waiter_thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,149 @@
+#
+# (C) Copyright IBM Corp. 2020
+# (C) Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import asyncio
+import threading
+import multiprocessing as mp
+from types import SimpleNamespace
+
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = 1000
+CONCURRENCY_INITIAL = 50
+DECREASE_FACTOR = 0.5
+LATENCY_TOLERANCE = 3
+METRICS_WEIGHT = 0.05
+MIN_LATENCY_WINDOW = 60
+
+
+class ConcurrencyController:
+    """
+    Limits the invocations in flight of all the invoker threads and processes.
+    The limit adapts with additive increase, multiplicative decrease: each
+    accepted invocation adds 1/limit, so the limit grows by one per round of
+    invocations, while a rejection, or an average latency above
+    LATENCY_TOLERANCE times the lowest recent one, halves it, at most once
+    per round trip. The lowest latency is taken over the current and the
+    previous window of MIN_LATENCY_WINDOW seconds, so it follows a backend
+    that became slower.
+    """
+
+    def __init__(self, initial_limit=CONCURRENCY_INITIAL, min_limit=CONCURRENCY_MIN,
+                 max_limit=CONCURRENCY_MAX, processes=False, clock=time.time):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.clock = clock
+
+        # Processes are forked after the controller is created, so they share its state
+        if processes:
+            self.cond = mp.Condition()
+            value = lambda typecode, v: mp.Value(typecode, v, lock=False)
+        else:
+            self.cond = threading.Condition()
+            value = lambda typecode, v: SimpleNamespace(value=v)
+
+        self._limit = value('d', min(max(initial_limit, min_limit), max_limit))
+        self._inflight = value('i', 0)
+        self._invocations = value('i', 0)
+        self._rejections = value('i', 0)
+        self._rejection_rate = value('d', 0.0)
+        self._latency = value('d', 0.0)
+        self._min_latency = value('d', 0.0)
+        self._window_min_latency = value('d', 0.0)
+        self._window_start = value('d', 0.0)
+        self._last_decrease = value('d', 0.0)
+
+    def acquire(self):
+        """
+        Waits until the invocations in flight are below the limit
+        """
+        with self.cond:
+            while self._inflight.value >= int(self._limit.value):
+                self.cond.wait()
+            self._inflight.value += 1
+
+    def try_acquire(self):
+        with self.cond:
+            if self._inflight.value >= int(self._limit.value):
+                return False
+            self._inflight.value += 1
+            return True
+
+    async def acquire_async(self):
+        """
+        Waits for the limit from a thread, without blocking the event loop
+        """
+        if not self.try_acquire():
+            await asyncio.get_running_loop().run_in_executor(None, self.acquire)
+
+    def release(self, rejected, latency):
+        """
+        Records the outcome of an invocation and adapts the limit
+        """
+        now = self.clock()
+        with self.cond:
+            self._inflight.value -= 1
+            self._invocations.value += 1
+            self._rejections.value += int(rejected)
+            self._rejection_rate.value += METRICS_WEIGHT * (int(rejected) - self._rejection_rate.value)
+
+            congested = rejected
+            if not rejected:
+                self._update_min_latency(now, latency)
+                if self._latency.value == 0:
+                    self._latency.value = latency
+                self._latency.value += METRICS_WEIGHT * (latency - self._latency.value)
+                congested = self._latency.value > LATENCY_TOLERANCE * self._get_min_latency()
+
+            if not congested:
+                self._limit.value = min(self.max_limit, self._limit.value + 1 / self._limit.value)
+            elif now - self._last_decrease.value > max(latency, self._latency.value):
+                # The rest of the calls rejected within the same round trip see the same congestion
+                self._limit.value = max(self.min_limit, self._limit.value * DECREASE_FACTOR)
+                self._last_decrease.value = now
+
+            self.cond.notify_all()
+
+    def _update_min_latency(self, now, latency):
+        """
+        Keeps the lowest latency of the current window, and of the previous
+        one once the current window ends
+        """
+        elapsed = now - self._window_start.value
+        if elapsed >= MIN_LATENCY_WINDOW:
+            # Without invocations during the last window, the previous one is empty
+            self._min_latency.value = self._window_min_latency.value if elapsed < 2 * MIN_LATENCY_WINDOW else 0.0
+            self._window_min_latency.value = 0.0
+            self._window_start.value = now
+        if self._window_min_latency.value == 0 or latency < self._window_min_latency.value:
+            self._window_min_latency.value = latency
+
+    def _get_min_latency(self):
+        return min((v for v in (self._min_latency.value, self._window_min_latency.value) if v > 0), default=0.0)
+
+    def metrics(self):
+        """
+        Returns the current limit, the invocations in flight, the totals and
+        the recent rejection rate and latency
+        """
+        with self.cond:
+            return {'limit': int(self._limit.value),
+                    'inflight': self._inflight.value,
+                    'invocations': self._invocations.value,
+                    'rejections': self._rejections.value,
+                    'rejection_rate': round(self._rejection_rate.value, 4),
+                    'latency': round(self._latency.value, 4)}
@@ -16,6 +16,7 @@
 #
 
 import copy
+import json
 import signal
 import logging
 import atexit
@@ -26,12 +27,14 @@ import sys
 import time
 import subprocess as sp
 from functools import partial
+from collections.abc import Iterator
 from concurrent.futures import ThreadPoolExecutor
 
 from lithops.invokers import ServerlessInvoker, StandaloneInvoker
 from lithops.storage import InternalStorage
 from lithops.wait import wait_storage, wait_rabbitmq, ALL_COMPLETED
-from lithops.job import create_map_job, create_reduce_job
+from lithops.job import create_map_job, create_map_job_stream, create_reduce_job, \
+    create_reduce_tree, create_pipeline
 from lithops.config import default_config, extract_storage_config, \
     extract_localhost_config, extract_standalone_config, \
     extract_serverless_config
@@ -45,20 +48,37 @@ from lithops.serverless.serverless import ServerlessHandler
 from lithops.storage.utils import create_job_key
 
 from lithops.triggerflow.eventsources import KafkaEventSource, RedisEventSource, ObjectStorageEventSource
+from lithops.job.serialize import serialization_cache, start_serialization_pool
+from lithops.triggerflow.snapshot import put_snapshot, get_snapshot, create_executor_prefixes, \
+    put_serialization_cache, get_serialization_cache
+from lithops.triggerflow.futures import set_call_status, reference_futures
 from triggerflow import Triggerflow, CloudEvent, DefaultActions, DefaultConditions
 
 logger = logging.getLogger(__name__)
 
 
+class CoordinatorExit(SystemExit):
+    """
+    Ends the coordinator activation, once the workflow is left to a trigger
+    or to another coordinator
+    """
+    pass
+
+
 class FunctionExecutor:
     """
     Executor abstract class that contains the common logic
     for the Localhost, Serverless and Standalone executors
     """
 
+    WARM_WAIT_MARGIN = 5
+    BATCH_DURATION = 10
+
     def __init__(self, type=None, session_id=None, mode=None, config=None, backend=None,
                  storage=None, runtime=None, runtime_memory=None, rabbitmq_monitor=None,
-                 workers=None, remote_invoker=None, log_level=None, start_time=0):
+                 workers=None, remote_invoker=None, log_level=None, start_time=0,
+                 event_cursor=None, snapshot_job_id=None, trigger_job_id=None, trigger_time=None,
+                 stream_calls=None):
 
                 # ------------------ TRIGGERFLOW -------------------
         if session_id:
@@ -113,6 +133,8 @@ class FunctionExecutor:
             config_ow['lithops']['rabbitmq_monitor'] = rabbitmq_monitor
 
         self.config = default_config(copy.deepcopy(config), config_ow)
+        # Forked before the invoker starts its threads
+        start_serialization_pool(self.config['lithops'].get('serializer_processes', 0))
 
         self.log_active = logger.getEffectiveLevel() != logging.WARNING
         self.is_lithops_worker = is_lithops_worker()
@@ -145,17 +167,46 @@ class FunctionExecutor:
         # ------------------ TRIGGERFLOW -------------------
         self.tf = None
         self.tf_sink_data = None
+        self.event_cursor = event_cursor
+        self.snapshot_job_id = snapshot_job_id
+        self.trigger_time = trigger_time
+        # Final number of calls of each streaming job, known once it is exhausted
+        self.stream_calls = stream_calls or {}
+        self.snapshot_jobs = {}
+        self.recovered_jobs = {}
+        self.job_durations = {}
+        self.call_durations = {}
+        self.pending_jobs = []
 
         if self.event_sourcing:
+            self.warm_coordinator = self.config['triggerflow'].get('warm_coordinator', False)
+            self.deferred_invocation = self.config['triggerflow'].get('deferred_invocation', False)
             sink = self.config['triggerflow']['sink']
             if sink == 'kafka':
-                event_source = KafkaEventSource(self.config['kafka'], self.executor_id)
+                event_source = KafkaEventSource(self.config['kafka'], self.executor_id,
+                                                self.event_cursor, self.internal_storage)
             elif sink == 'redis':
-                event_source = RedisEventSource(self.config['redis'], self.executor_id)
+                event_source = RedisEventSource(self.config['redis'], self.executor_id, self.event_cursor)
             else:
                 event_source = ObjectStorageEventSource(self.config['redis'], self.internal_storage, self.executor_id)
+            self.event_source = event_source
+
+            # The warm coordinator that waited for the same jobs may have already continued
+            if trigger_job_id and self.warm_coordinator and \
+                    not event_source.claim(trigger_job_id, trigger_time):
+                logger.info('ExecutorID {} | JobID {} - Workflow already continued by a warm '
+                            'coordinator'.format(self.executor_id, trigger_job_id))
+                raise CoordinatorExit()
 
             self.event_sourcing_jobs = event_source.get_events()
+            self.event_cursor = event_source.cursor
+
+            if self.snapshot_job_id:
+                snapshot = get_snapshot(self.internal_storage, self.executor_id, self.snapshot_job_id)
+                if snapshot:
+                    self.snapshot_jobs = snapshot['jobs']
+            if os.environ.get('LITHOPS_FIRST_EXEC') == 'False':
+                get_serialization_cache(self.internal_storage, self.executor_id, serialization_cache)
 
             logger.info('Triggerflow - Creating client')
             self.tf = Triggerflow(endpoint=self.config['triggerflow']['endpoint'],
@@ -206,6 +257,228 @@ class FunctionExecutor:
         self.total_jobs += 1
         return '{}{}'.format(call_type, job_id)
 
+    def _recover_job(self, job_id, futures):
+        """
+        Sets the statuses of an already finished job from its termination events
+        """
+        call_statuses = {cs['call_id']: cs for cs in self.event_sourcing_jobs[job_id]}
+
+        def recover_future(f):
+            if f.call_id in call_statuses:
+                set_call_status(f, call_statuses[f.call_id], self.internal_storage, throw_except=False)
+
+        with ThreadPoolExecutor(128) as pool:
+            list(pool.map(recover_future, futures))
+        self.recovered_jobs[job_id] = futures
+        self._update_job_durations(futures)
+
+    def _update_job_durations(self, futures):
+        call_durations = {}
+        for f in futures:
+            if 'worker_exec_time' in f.stats:
+                duration = self.job_durations.get(f.function_name, 0)
+                self.job_durations[f.function_name] = max(duration, f.stats['worker_exec_time'])
+            if 'worker_func_exec_time' in f.stats:
+                call_durations.setdefault(f.function_name, []).append(f.stats['worker_func_exec_time'])
+        for function_name, durations in call_durations.items():
+            self.call_durations[function_name] = sum(durations) / len(durations)
+
+    def _get_batch_size(self, map_function, map_iterdata, batch_size):
+        """
+        Resolves the 'auto' batch size from the measured duration of previous
+        calls of the function, so each activation runs for about BATCH_DURATION
+        seconds without using fewer activations than available workers
+        """
+        if batch_size is None:
+            batch_size = self.config['lithops'].get('batch_size', 1)
+        if batch_size != 'auto':
+            return int(batch_size)
+
+        function_name = map_function.__name__
+        if function_name not in self.call_durations:
+            logger.debug('ExecutorID {} - No calls of {}() measured yet, not batching'
+                         .format(self.executor_id, function_name))
+            return 1
+
+        batch_size = int(self.BATCH_DURATION / max(self.call_durations[function_name], 0.001))
+        if type(map_iterdata) in (list, range, set):
+            workers = self.config['lithops'].get('workers') or 1
+            batch_size = min(batch_size, len(map_iterdata) // workers)
+        batch_size = max(1, batch_size)
+        logger.info('ExecutorID {} - Calls of {}() take {}s, batching {} calls per activation'
+                    .format(self.executor_id, function_name,
+                            round(self.call_durations[function_name], 3), batch_size))
+        return batch_size
+
+    def _recover_snapshot_job(self, job_id):
+        """
+        Returns the futures of a job stored in the snapshot, if any
+        """
+        if job_id not in self.snapshot_jobs:
+            return None
+        logger.info('ExecutorID {} | JobID {} - Job found in snapshot'.format(self.executor_id, job_id))
+        futures = self.snapshot_jobs[job_id]
+        self.futures.extend(futures)
+        self._update_job_durations(futures)
+        return futures
+
+    def _save_snapshot(self):
+        """
+        Stores a snapshot with all the jobs recovered so far, so the next wake
+        does not need to recover them one by one
+        """
+        if not self.recovered_jobs:
+            return self.snapshot_job_id
+        jobs = self.snapshot_jobs.copy()
+        jobs.update(self.recovered_jobs)
+        last_job_id = list(self.recovered_jobs)[-1]
+        return put_snapshot(self.internal_storage, self.executor_id, last_job_id, jobs,
+                            self.snapshot_job_id) or self.snapshot_job_id
+
+    def _create_termination_events(self, subjects):
+        events = [CloudEvent().SetEventType('event.triggerflow.termination.success').SetSubject(subject)
+                  for subject in subjects]
+        return events[0] if len(events) == 1 else events
+
+    def _add_trigger(self, jobs, condition, total_activations):
+        """
+        Registers the trigger that awakes the coordinator once all the jobs finish
+        """
+        api_host = os.environ['__OW_API_HOST']
+        action = os.environ['__OW_ACTION_NAME'].split('/', 2)[2]
+        ns = os.environ['__OW_NAMESPACE']
+        snapshot_job_id = self._save_snapshot()
+
+        subjects = ['{}/{}/{}'.format(self.executor_id, job.job_id, job.function_name) for job, _ in jobs]
+
+        self.trigger_time = time.time()
+        self.tf.add_trigger(
+            event=self._create_termination_events(subjects),
+            condition=condition,
+            action=DefaultActions.IBM_CF_INVOKE,
+            context={'url': '{}/api/v1/namespaces/{}/actions/{}'.format(api_host, ns, action),
+                     'api_key': os.environ['__OW_API_KEY'],
+                     'sink': self.tf_sink_data,
+                     'invoke_kwargs': {'config': self.config,
+                                       'execution_id': self.executor_id.split('/')[0],
+                                       'start_time': self.start_time,
+                                       'event_cursor': self.event_cursor,
+                                       'snapshot_job_id': snapshot_job_id,
+                                       'trigger_job_id': jobs[-1][0].job_id,
+                                       'trigger_time': self.trigger_time,
+                                       'stream_calls': self.stream_calls},
+                     'iter_data': {},
+                     'total_activations': total_activations}
+            )
+
+    def _wait_jobs(self, jobs):
+        """
+        Warm coordinator: if the jobs are expected to finish within the remaining
+        time of this activation, waits for their termination events in place
+        instead of exiting. The trigger of the jobs is kept as a fallback.
+        """
+        function_names = {job.function_name for job, _ in jobs}
+        if not self.warm_coordinator or not function_names.issubset(self.job_durations):
+            return False
+
+        deadline = float(os.environ.get('__OW_DEADLINE', 0)) / 1000 - self.WARM_WAIT_MARGIN
+        if max(self.job_durations[fn] for fn in function_names) >= deadline - time.time():
+            return False
+
+        logger.info('ExecutorID {} - Waiting for {} jobs in place - Timeout: {}s'
+                    .format(self.executor_id, len(jobs), round(deadline - time.time(), 3)))
+        job_calls = {job.job_id: job.total_calls for job, _ in jobs}
+        if not self.event_source.wait_events(self.event_sourcing_jobs, job_calls, deadline - time.time()):
+            return False
+
+        # The coordinator woken by the fallback trigger may have already continued
+        if not self.event_source.claim(jobs[-1][0].job_id, self.trigger_time):
+            logger.info('ExecutorID {} - Workflow already continued by the trigger'.format(self.executor_id))
+            return False
+
+        self.event_source.save_state(self.event_sourcing_jobs)
+        self.event_cursor = self.event_source.cursor
+        return True
+
+    def _trigger_pending_jobs(self):
+        """
+        Registers a single trigger that joins all the jobs invoked since the
+        last trigger, then waits for them in place or exits the coordinator
+        """
+        jobs = self.pending_jobs
+        self.pending_jobs = []
+        total_activations = sum(job.total_activations for job, _ in jobs)
+        if total_activations == 1:
+            condition = DefaultConditions.TRUE
+        else:
+            condition = DefaultConditions.FUNCTION_JOIN
+
+        self._add_trigger(jobs, condition, total_activations)
+        if self._wait_jobs(jobs):
+            for job, futures in jobs:
+                self._recover_job(job.job_id, futures)
+        else:
+            self._exit_coordinator()
+
+    def _tag_reduce_inputs(self, job, level, reduce_tree, reduce_job_ids):
+        """
+        Tags each call of the job at the given level of the reduce tree with
+        the job and call ids of the reducer that consumes its output
+        """
+        for reducer_level, reducers in enumerate(reduce_tree, 1):
+            for index, inputs in enumerate(reducers):
+                for input_level, input_index in inputs:
+                    if input_level == level:
+                        tag = '{}.{:05d}'.format(reduce_job_ids[reducer_level], index)
+                        job.trigger_tags['{:05d}'.format(input_index)] = tag
+
+    def _add_reduce_triggers(self, reduce_tree, jobs):
+        """
+        Registers one trigger per reducer of the reduce tree, that invokes it
+        as soon as all its input calls finish. The input calls of each reducer
+        are tagged with its job and call ids, so the join only counts them.
+        """
+        api_host = os.environ['__OW_API_HOST']
+        ns = os.environ['__OW_NAMESPACE']
+        backend = self.compute_handler.backend
+
+        for level, reducers in enumerate(reduce_tree, 1):
+            job = jobs[level]
+            action = backend._format_action_name(job.runtime_name, job.runtime_memory)
+            url = '{}/api/v1/namespaces/{}/actions/{}/{}'.format(api_host, ns, backend.package, action)
+            self.invoker.put_job_payload(job)
+            logger.info('ExecutorID {} | JobID {} - Adding {} reducer triggers'
+                        .format(self.executor_id, job.job_id, len(reducers)))
+
+            for index, inputs in enumerate(reducers):
+                call_id = '{:05d}'.format(index)
+                subjects = {}
+                for input_level, input_index in inputs:
+                    input_job = jobs[input_level]
+                    tag = input_job.trigger_tags['{:05d}'.format(input_index)]
+                    subjects[input_level] = '{}/{}/{}:{}'.format(self.executor_id, input_job.job_id,
+                                                                 input_job.function_name, tag)
+
+                self.tf.add_trigger(
+                    event=self._create_termination_events(list(subjects.values())),
+                    condition=DefaultConditions.FUNCTION_JOIN,
+                    action=DefaultActions.IBM_CF_INVOKE,
+                    context={'url': url,
+                             'api_key': os.environ['__OW_API_KEY'],
+                             'sink': self.tf_sink_data,
+                             'invoke_kwargs': self.invoker.create_payload(job, call_id),
+                             'iter_data': {},
+                             'total_activations': len(inputs)}
+                    )
+
+    def _exit_coordinator(self):
+        if serialization_cache.dirty:
+            put_serialization_cache(self.internal_storage, self.executor_id, serialization_cache)
+        self.invoker.stop()
+        del self.invoker
+        del self.internal_storage
+        raise CoordinatorExit()
+
     def call_async(self, func, data, extra_env=None, runtime_memory=None,
                    timeout=None, include_modules=[], exclude_modules=[]):
         """
@@ -226,6 +499,10 @@ class FunctionExecutor:
         job_id = self._create_job_id('A')
         self.last_call = 'call_async'
 
+        futures = self._recover_snapshot_job(job_id)
+        if futures:
+            return futures[0]
+
         already_invoked = False
         if self.event_sourcing:
             logger.info('ExecutorID {} | JobID {} - Trying to recover the Job'.format(self.executor_id, job_id))
@@ -255,35 +532,12 @@ class FunctionExecutor:
         futures = self.invoker.run(job)
 
         if already_invoked:
-            for f in futures:
-                for call_status in self.event_sourcing_jobs[job_id]:
-                    if f.call_id == call_status['call_id']:
-                        f._call_status = call_status
-                        f.result(throw_except=False, internal_storage=self.internal_storage)
+            self._recover_job(job_id, futures)
 
         if self.event_sourcing and not already_invoked:
-            api_host = os.environ['__OW_API_HOST']
-            action = os.environ['__OW_ACTION_NAME'].split('/', 2)[2]
-            ns = os.environ['__OW_NAMESPACE']
-            subject = '{}/{}/{}'.format(self.executor_id, job_id, func.__name__)
-
-            self.tf.add_trigger(
-                event=CloudEvent().SetEventType('event.triggerflow.termination.success').SetSubject(subject),
-                condition=DefaultConditions.TRUE,
-                action=DefaultActions.IBM_CF_INVOKE,
-                context={'url': '{}/api/v1/namespaces/{}/actions/{}'.format(api_host, ns, action),
-                         'api_key': os.environ['__OW_API_KEY'],
-                         'sink': self.tf_sink_data,
-                         'invoke_kwargs': {'config': self.config,
-                                           'execution_id': self.executor_id.split('/')[0],
-                                           'start_time': self.start_time},
-                         'iter_data': {},
-                         'total_activations': 1}
-                )
-            self.invoker.stop()
-            del self.invoker
-            del self.internal_storage
-            exit()
+            self.pending_jobs.append((job, futures))
+            if not self.deferred_invocation:
+                self._trigger_pending_jobs()
 
         self.futures.extend(futures)
 
@@ -291,12 +545,16 @@ class FunctionExecutor:
 
     def map(self, map_function, map_iterdata, extra_args=None, extra_env=None,
             runtime_memory=None, chunk_size=None, chunk_n=None, timeout=None,
-            invoke_pool_threads=500, include_modules=[], exclude_modules=[]):
+            invoke_pool_threads=500, include_modules=[], exclude_modules=[],
+            batch_size=None, segment_size=None):
         """
         For running multiple function executions asynchronously
 
         :param map_function: the function to map over the data
-        :param map_iterdata: An iterable of input data
+        :param map_iterdata: An iterable of input data. It may contain futures of previous
+                             calls, the functions get their results from the storage.
+                             It may also be an iterator, such as a generator, whose
+                             elements are invoked in segments as they are produced
         :param extra_args: Additional args to pass to the function activations
         :param extra_env: Additional env variables for action environment
         :param runtime_memory: Memory to use to run the function
@@ -312,17 +570,38 @@ class FunctionExecutor:
         :param include_modules: Explicitly pickle these dependencies
         :param exclude_modules: Explicitly keep these modules from pickled
                                 dependencies
+        :param batch_size: Number of elements of the iterdata processed by each
+                           function activation, or 'auto' to size the batches
+                           from the measured duration of previous calls
+        :param segment_size: Number of elements of an iterator uploaded and invoked
+                             at once. Default 1000
 
         :return: A list with size `len(iterdata)` of futures.
         """
         job_id = self._create_job_id('M')
         self.last_call = 'map'
 
+        # Futures of previous jobs are passed by reference, the functions get their results
+        map_iterdata = reference_futures(map_iterdata, self.cleaned_jobs)
+
+        futures = self._recover_snapshot_job(job_id)
+        if futures:
+            return futures
+
+        # Iterators are consumed in segments, invoked as soon as they are uploaded
+        stream = isinstance(map_iterdata, Iterator)
+        if stream and not (isinstance(self.invoker, ServerlessInvoker) and not self.invoker.remote_invoker):
+            map_iterdata = list(map_iterdata)
+            stream = False
+
         already_invoked = False
         if self.event_sourcing:
             logger.info('ExecutorID {} | JobID {} - Trying to recover the Job'.format(self.executor_id, job_id))
             if job_id in self.event_sourcing_jobs:
-                if len(self.event_sourcing_jobs[job_id]) == len(map_iterdata):
+                # A streaming job is only complete once it reaches the total number
+                # of calls saved when its iterator was exhausted
+                total_calls = self.stream_calls.get(job_id) if stream else len(map_iterdata)
+                if total_calls is not None and len(self.event_sourcing_jobs[job_id]) >= total_calls:
                     logger.info('ExecutorID {} | JobID {} - Job found in storage'.format(self.executor_id, job_id))
                     already_invoked = True
             else:
@@ -336,71 +615,113 @@ class FunctionExecutor:
         if extra_env:
             extra_env.update(extra_env_vars)
 
-        job = create_map_job(self.config, self.internal_storage,
-                             self.executor_id, job_id,
-                             map_function=map_function,
-                             iterdata=map_iterdata,
-                             runtime_meta=runtime_meta,
-                             runtime_memory=runtime_memory,
-                             extra_env=extra_env,
-                             include_modules=include_modules,
-                             exclude_modules=exclude_modules,
-                             execution_timeout=timeout,
-                             extra_args=extra_args,
-                             obj_chunk_size=chunk_size,
-                             obj_chunk_number=chunk_n,
-                             invoke_pool_threads=invoke_pool_threads,
-                             already_invoked=already_invoked)
-
-        def get_result(f):
-            f.result(throw_except=False, internal_storage=self.internal_storage)
+        batch_size = self._get_batch_size(map_function, map_iterdata, batch_size)
+
+        if stream:
+            job = None
+            futures = []
+            for job, first_call in create_map_job_stream(self.config, self.internal_storage,
+                                                         self.executor_id, job_id,
+                                                         map_function=map_function,
+                                                         iterdata=map_iterdata,
+                                                         runtime_meta=runtime_meta,
+                                                         runtime_memory=runtime_memory,
+                                                         extra_env=extra_env,
+                                                         include_modules=include_modules,
+                                                         exclude_modules=exclude_modules,
+                                                         execution_timeout=timeout,
+                                                         extra_args=extra_args,
+                                                         obj_chunk_size=chunk_size,
+                                                         obj_chunk_number=chunk_n,
+                                                         invoke_pool_threads=invoke_pool_threads,
+                                                         already_invoked=already_invoked,
+                                                         batch_size=batch_size,
+                                                         segment_size=segment_size):
+                futures.extend(self.invoker.run(job, first_call))
+            if job is None:
+                return futures
+            # The total number of calls is final, so the join trigger can be added
+            job.streaming = False
+            self.stream_calls[job_id] = job.total_calls
+            logger.info('ExecutorID {} | JobID {} - Stream finished - Total: {} calls'
+                        .format(self.executor_id, job_id, job.total_calls))
+        else:
+            job = create_map_job(self.config, self.internal_storage,
+                                 self.executor_id, job_id,
+                                 map_function=map_function,
+                                 iterdata=map_iterdata,
+                                 runtime_meta=runtime_meta,
+                                 runtime_memory=runtime_memory,
+                                 extra_env=extra_env,
+                                 include_modules=include_modules,
+                                 exclude_modules=exclude_modules,
+                                 execution_timeout=timeout,
+                                 extra_args=extra_args,
+                                 obj_chunk_size=chunk_size,
+                                 obj_chunk_number=chunk_n,
+                                 invoke_pool_threads=invoke_pool_threads,
+                                 already_invoked=already_invoked,
+                                 batch_size=batch_size)
 
-        futures = self.invoker.run(job)
+            futures = self.invoker.run(job)
 
         if already_invoked:
-            for f in futures:
-                for call_status in self.event_sourcing_jobs[job_id]:
-                    if f.call_id == call_status['call_id']:
-                        f._call_status = call_status
-
-            pool = ThreadPoolExecutor(128)
-            pool.map(get_result, futures)
-            pool.close()
-            pool.join()
+            self._recover_job(job_id, futures)
 
         if self.event_sourcing and not already_invoked:
-            api_host = os.environ['__OW_API_HOST']
-            action = os.environ['__OW_ACTION_NAME'].split('/', 2)[2]
-            ns = os.environ['__OW_NAMESPACE']
-            subject = '{}/{}/{}'.format(self.executor_id, job_id, map_function.__name__)
-
-            self.tf.add_trigger(
-                event=CloudEvent().SetEventType('event.triggerflow.termination.success').SetSubject(subject),
-                condition=DefaultConditions.FUNCTION_JOIN,
-                action=DefaultActions.IBM_CF_INVOKE,
-                context={'url': '{}/api/v1/namespaces/{}/actions/{}'.format(api_host, ns, action),
-                         'api_key': os.environ['__OW_API_KEY'],
-                         'sink': self.tf_sink_data,
-                         'invoke_kwargs': {'config': self.config,
-                                           'execution_id': self.executor_id.split('/')[0],
-                                           'start_time': self.start_time},
-                         'iter_data': {},
-                         'total_activations': len(map_iterdata)}
-                )
-            self.invoker.stop()
-            del self.invoker
-            del self.internal_storage
-            exit()
+            self.pending_jobs.append((job, futures))
+            if not self.deferred_invocation:
+                self._trigger_pending_jobs()
 
         self.futures.extend(futures)
 
         return futures
 
+    def pipeline(self, map_functions, map_iterdata, extra_args=None, extra_env=None,
+                 runtime_memory=None, chunk_size=None, chunk_n=None, timeout=None,
+                 invoke_pool_threads=500, include_modules=[], exclude_modules=[],
+                 batch_size=None):
+        """
+        Map a chain of element-wise functions over the data. Each activation
+        runs all the functions back to back, each one over the output of the
+        previous one, and only the output of the last function is stored.
+
+        :param map_functions: List of functions to apply in order
+        :param map_iterdata: An iterable of input data of the first function
+        :param extra_args: Additional args to pass to the first function
+        :param extra_env: Additional env variables for action environment
+        :param runtime_memory: Memory to use to run the functions
+        :param chunk_size: the size of the data chunks to split each object.
+        :param chunk_n: Number of chunks to split each object.
+        :param timeout: Time that the functions have to complete their execution
+                        before raising a timeout
+        :param invoke_pool_threads: Number of threads to use to invoke
+        :param include_modules: Explicitly pickle these dependencies
+        :param exclude_modules: Explicitly keep these modules from pickled
+                                dependencies
+        :param batch_size: Number of elements of the iterdata processed by each
+                           function activation, or 'auto'
+
+        :return: A list with size `len(iterdata)` of futures.
+        """
+        return self.map(create_pipeline(map_functions), map_iterdata,
+                        extra_args=extra_args,
+                        extra_env=extra_env,
+                        runtime_memory=runtime_memory,
+                        chunk_size=chunk_size,
+                        chunk_n=chunk_n,
+                        timeout=timeout,
+                        invoke_pool_threads=invoke_pool_threads,
+                        include_modules=include_modules,
+                        exclude_modules=exclude_modules,
+                        batch_size=batch_size)
+
     def map_reduce(self, map_function, map_iterdata, reduce_function,
                    extra_args=None, extra_env=None, map_runtime_memory=None,
                    reduce_runtime_memory=None, chunk_size=None, chunk_n=None,
                    timeout=None, invoke_pool_threads=500, reducer_one_per_object=False,
-                   reducer_wait_local=False, include_modules=[], exclude_modules=[]):
+                   reducer_wait_local=False, include_modules=[], exclude_modules=[],
+                   reducer_fanin=None, reducer_streaming=False):
         """
         Map the map_function over the data and apply the reduce_function across all futures.
         This method is executed all within CF.
@@ -419,7 +740,12 @@ class FunctionExecutor:
         :param remote_invocation: Enable or disable remote_invocation mechanism. Default 'False'
         :param timeout: Time that the functions have to complete their execution before raising a timeout.
         :param reducer_one_per_object: Set one reducer per object after running the partitioner
-        :param reducer_wait_local: Wait for results locally
+        :param reducer_wait_local: Wait for results locally. Ignored with Triggerflow event sourcing
+        :param reducer_fanin: Build a reduce tree where each reducer consumes at most this number
+                              of outputs. Default None (a single level of reducers).
+        :param reducer_streaming: With Triggerflow event sourcing, invoke the reducers along with the map
+                                  and pass them the results as an iterator that yields each one as soon
+                                  as its termination event reaches the sink. Default False.
         :param invoke_pool_threads: Number of threads to use to invoke.
         :param include_modules: Explicitly pickle these dependencies.
         :param exclude_modules: Explicitly keep these modules from pickled dependencies.
@@ -428,8 +754,29 @@ class FunctionExecutor:
         """
         self.last_call = 'map_reduce'
         map_job_id = self._create_job_id('M')
+        reduce_job_id = map_job_id.replace('M', 'R')
+        map_iterdata = reference_futures(map_iterdata, self.cleaned_jobs)
+
+        # ------------------ TRIGGERFLOW -------------------
+        # Otherwise both jobs are recovered from their events below
+        if map_job_id in self.snapshot_jobs and reduce_job_id in self.snapshot_jobs:
+            return self._recover_snapshot_job(map_job_id) + self._recover_snapshot_job(reduce_job_id)
+
+        already_invoked = False
+        if self.event_sourcing:
+            logger.info('ExecutorID {} | JobID {} - Trying to recover the Job'.format(self.executor_id, map_job_id))
+            # The final reducers only run once all the map calls and the
+            # intermediate reducers finished
+            if reduce_job_id in self.event_sourcing_jobs:
+                logger.info('ExecutorID {} | JobID {} - Job found in storage'.format(self.executor_id, map_job_id))
+                already_invoked = True
+            else:
+                logger.info('ExecutorID {} | JobID {} - Job not found'.format(self.executor_id, map_job_id))
+        # --------------------------------------------------
 
-        runtime_meta = self.invoker.select_runtime(map_job_id, map_runtime_memory)
+        runtime_meta = {}
+        if not already_invoked:
+            runtime_meta = self.invoker.select_runtime(map_job_id, map_runtime_memory)
 
         map_job = create_map_job(self.config, self.internal_storage,
                                  self.executor_id, map_job_id,
@@ -444,35 +791,82 @@ class FunctionExecutor:
                                  include_modules=include_modules,
                                  exclude_modules=exclude_modules,
                                  execution_timeout=timeout,
-                                 invoke_pool_threads=invoke_pool_threads)
+                                 invoke_pool_threads=invoke_pool_threads,
+                                 already_invoked=already_invoked)
+
+        reduce_tree = create_reduce_tree(map_job, reducer_one_per_object, reducer_fanin)
+        # The intermediate ids hold no '-' and are not a prefix of other job ids,
+        # as lithops splits and matches the job keys by them
+        reduce_job_ids = {level: 'L{}{}'.format(level, reduce_job_id) for level in range(1, len(reduce_tree))}
+        reduce_job_ids[len(reduce_tree)] = reduce_job_id
+
+        reduce_extra_env = extra_env
+        if reducer_streaming and not self.event_sourcing:
+            logger.warning('ExecutorID {} | JobID {} - Streaming reducers require Triggerflow '
+                           'event sourcing, waiting for the map results instead'
+                           .format(self.executor_id, reduce_job_id))
+        elif reducer_streaming:
+            reduce_extra_env = extra_env.copy() if extra_env else {}
+            reduce_extra_env.update({'__PW_REDUCE_STREAM': True,
+                                     '__PW_REDUCE_STREAM_CURSOR': json.dumps(self.event_source.cursor)})
+
+        # With event sourcing, the reducers are invoked by Triggerflow as soon
+        # as their inputs finish, instead of waiting for them within the functions
+        triggered_reduce = self.event_sourcing and not reducer_streaming
+        if triggered_reduce:
+            self._tag_reduce_inputs(map_job, 0, reduce_tree, reduce_job_ids)
 
         map_futures = self.invoker.run(map_job)
         self.futures.extend(map_futures)
 
-        if reducer_wait_local:
+        if reducer_wait_local and not self.event_sourcing:
             self.wait(fs=map_futures)
 
-        reduce_job_id = map_job_id.replace('M', 'R')
-
-        runtime_meta = self.invoker.select_runtime(reduce_job_id, reduce_runtime_memory)
-
-        reduce_job = create_reduce_job(self.config, self.internal_storage,
-                                       self.executor_id, reduce_job_id,
-                                       reduce_function, map_job, map_futures,
-                                       runtime_meta=runtime_meta,
-                                       runtime_memory=reduce_runtime_memory,
-                                       reducer_one_per_object=reducer_one_per_object,
-                                       extra_env=extra_env,
-                                       include_modules=include_modules,
-                                       exclude_modules=exclude_modules)
-
-        reduce_futures = self.invoker.run(reduce_job)
+        runtime_meta = {}
+        if not already_invoked:
+            runtime_meta = self.invoker.select_runtime(reduce_job_id, reduce_runtime_memory)
+
+        jobs = [map_job]
+        jobs_futures = [map_futures]
+        for level, reducers in enumerate(reduce_tree, 1):
+            reduce_job = create_reduce_job(self.config, self.internal_storage,
+                                           self.executor_id, reduce_job_ids[level],
+                                           reduce_function, map_job, map_futures,
+                                           runtime_meta=runtime_meta,
+                                           runtime_memory=reduce_runtime_memory,
+                                           reducer_one_per_object=reducer_one_per_object,
+                                           extra_env=reduce_extra_env,
+                                           include_modules=include_modules,
+                                           exclude_modules=exclude_modules,
+                                           already_invoked=already_invoked,
+                                           reducer_futures=[[jobs_futures[l][i] for l, i in inputs]
+                                                            for inputs in reducers])
+            if triggered_reduce:
+                self._tag_reduce_inputs(reduce_job, level, reduce_tree, reduce_job_ids)
+                reduce_futures = self.invoker.create_futures(reduce_job)
+            else:
+                reduce_futures = self.invoker.run(reduce_job)
+            jobs.append(reduce_job)
+            jobs_futures.append(reduce_futures)
 
         self.futures.extend(reduce_futures)
 
         for f in map_futures:
             f._produce_output = False
 
+        # ------------------ TRIGGERFLOW -------------------
+        if already_invoked:
+            self._recover_job(map_job_id, map_futures)
+            self._recover_job(reduce_job_id, reduce_futures)
+
+        if self.event_sourcing and not already_invoked:
+            if triggered_reduce:
+                self._add_reduce_triggers(reduce_tree, jobs)
+            self.pending_jobs.append((reduce_job, reduce_futures))
+            if not self.deferred_invocation:
+                self._trigger_pending_jobs()
+        # --------------------------------------------------
+
         return map_futures + reduce_futures
 
     def wait(self, fs=None, throw_except=True, return_when=ALL_COMPLETED,
@@ -499,6 +893,11 @@ class FunctionExecutor:
             and `fs_notdone` is a list of futures that have not completed.
         :rtype: 2-tuple of list
         """
+        # ------------------ TRIGGERFLOW -------------------
+        if self.event_sourcing and self.pending_jobs:
+            self._trigger_pending_jobs()
+        # --------------------------------------------------
+
         futures = fs or self.futures
         if type(futures) != list:
             futures = [futures]
@@ -591,6 +990,7 @@ class FunctionExecutor:
         else:
             fs_done = [f for f in futures if f.ready or f.done]
             fs_notdone = [f for f in futures if not f.ready and not f.done]
+        self._update_job_durations(fs_done)
 
         return fs_done, fs_notdone
 
@@ -665,7 +1065,7 @@ class FunctionExecutor:
         create_timeline(ftrs_to_plot, dst)
         create_histogram(ftrs_to_plot, dst)
 
-    def clean(self, fs=None, cs=None, clean_cloudobjects=True, spawn_cleaner=True):
+    def clean(self, fs=None, cs=None, clean_cloudobjects=True, spawn_cleaner=True, workflow=False):
         """
         Deletes all the temp files from storage. These files include the function,
         the data serialization and the function invocation results. It can also clean
@@ -675,6 +1075,7 @@ class FunctionExecutor:
         :param cs: list of cloudobjects to clean
         :param clean_cloudobjects: true/false
         :param spawn_cleaner true/false
+        :param workflow: true/false, also remove the Triggerflow state of the finished workflow
         """
 
         os.makedirs(CLEANER_DIR, exist_ok=True)
@@ -701,11 +1102,26 @@ class FunctionExecutor:
                         .format(self.executor_id))
             data = {'jobs_to_clean': jobs_to_clean,
                     'clean_cloudobjects': clean_cloudobjects,
+                    'expire_functions': True,
                     'storage_config': self.internal_storage.get_storage_config()}
             save_data_to_clean(data)
             self.cleaned_jobs.update(jobs_to_clean)
 
-        if (jobs_to_clean or cs) and spawn_cleaner:
+        # ------------------ TRIGGERFLOW -------------------
+        # The snapshot, the serialization cache and the state of the event
+        # source are kept by the clean() of every wake, from atexit or wait(),
+        # as the next wake needs them. They are only removed on request, once
+        # the coordinator finished the workflow.
+        prefixes_to_clean = []
+        if self.event_sourcing and workflow:
+            self.event_source.clean()
+            prefixes_to_clean = create_executor_prefixes(self.executor_id)
+            data = {'prefixes_to_clean': prefixes_to_clean,
+                    'storage_config': self.internal_storage.get_storage_config()}
+            save_data_to_clean(data)
+        # --------------------------------------------------
+
+        if (jobs_to_clean or cs or prefixes_to_clean) and spawn_cleaner:
             log_file = open(CLEANER_LOG_FILE, 'a')
             cmdstr = '{} -m lithops.scripts.cleaner'.format(sys.executable)
             sp.Popen(cmdstr, shell=True, stdout=log_file, stderr=log_file)
@@ -17,14 +17,18 @@
 
 import os
 import sys
+import copy
 import json
 import pika
 import time
 import random
 import queue
+import asyncio
+import bisect
 import logging
 import multiprocessing as mp
-from threading import Thread
+from threading import Thread, BoundedSemaphore
+from collections import deque
 from types import SimpleNamespace
 from concurrent.futures import ThreadPoolExecutor
 from lithops.version import __version__
@@ -32,16 +36,33 @@ from lithops.future import ResponseFuture
 from lithops.config import extract_storage_config
 from lithops.utils import version_str, is_lithops_worker, is_unix_system
 from lithops.storage.utils import create_job_key
+from lithops.job.job import create_job_payload_key
 from lithops.constants import LOGGER_LEVEL
+from lithops.async_invoker import AsyncInvoker, INVOKE_MAX_INFLIGHT, INVOKE_POOL_SIZE
+from lithops.concurrency import ConcurrencyController, CONCURRENCY_MAX
+from lithops.triggerflow.eventsources import KafkaEventSource, RedisEventSource
 
 logger = logging.getLogger(__name__)
 
+EVENT_MONITOR_TIMEOUT = 1
+
+
+def is_first_call_of_batch(job, call_index):
+    """
+    Activations are identified by the first call of their batch. The
+    batches of a streaming job start again at the first call of each segment.
+    """
+    first_call = 0
+    if job.segment_first_calls:
+        first_call = job.segment_first_calls[bisect.bisect_right(job.segment_first_calls, call_index) - 1]
+    return (call_index - first_call) % job.batch_size == 0
+
 
 class Invoker:
     """
     Abstract invoker class
     """
-    def __init__(self, config, executor_id, internal_storage, compute_handler):
+    def __init__(self, config, executor_id, internal_storage, compute_handler, tf_sink_data=None):
 
         log_level = logger.getEffectiveLevel()
         self.log_active = log_level != logging.WARNING
@@ -53,6 +74,7 @@ class Invoker:
         self.internal_storage = internal_storage
         self.compute_handler = compute_handler
         self.is_lithops_worker = is_lithops_worker()
+        self.tf_sink_data = tf_sink_data
 
         self.workers = self.config['lithops'].get('workers')
         logger.debug('ExecutorID {} - Total available workers: {}'
@@ -73,6 +95,23 @@ class Invoker:
         """
         raise NotImplementedError
 
+    def create_futures(self, job, first_call=0):
+        """
+        Creates the futures of all the calls of a job, from first_call on
+        """
+        job.runtime_name = self.runtime_name
+
+        futures = []
+        for i in range(first_call, job.total_calls):
+            call_id = "{:05d}".format(i)
+            fut = ResponseFuture(call_id, job,
+                                 job.metadata.copy(),
+                                 self.storage_config)
+            fut._set_state(ResponseFuture.State.Invoked)
+            futures.append(fut)
+
+        return futures
+
     def stop(self):
         """
         Stop invoker-related processes
@@ -84,8 +123,8 @@ class StandaloneInvoker(Invoker):
     """
     Module responsible to perform the invocations against the Standalone backend
     """
-    def __init__(self, config, executor_id, internal_storage, compute_handler):
-        super().__init__(config, executor_id, internal_storage, compute_handler)
+    def __init__(self, config, executor_id, internal_storage, compute_handler, tf_sink_data=None):
+        super().__init__(config, executor_id, internal_storage, compute_handler, tf_sink_data)
 
     def select_runtime(self, job_id, runtime_memory):
         """
@@ -140,16 +179,7 @@ class StandaloneInvoker(Invoker):
         if not self.log_active:
             print(log_msg)
 
-        futures = []
-        for i in range(job.total_calls):
-            call_id = "{:05d}".format(i)
-            fut = ResponseFuture(call_id, job,
-                                 job.metadata.copy(),
-                                 self.storage_config)
-            fut._set_state(ResponseFuture.State.Invoked)
-            futures.append(fut)
-
-        return futures
+        return self.create_futures(job)
 
 
 class ServerlessInvoker(Invoker):
@@ -159,17 +189,31 @@ class ServerlessInvoker(Invoker):
 
     REMOTE_INVOKER_MEMORY = 2048
     INVOKER_PROCESSES = 2
+    INVOKE_ENGINES = ['threads', 'asyncio']
+    PENDING_CALLS_CHUNK = 100
 
-    def __init__(self, config, executor_id, internal_storage, compute_handler):
-        super().__init__(config, executor_id, internal_storage, compute_handler)
+    def __init__(self, config, executor_id, internal_storage, compute_handler, tf_sink_data=None):
+        super().__init__(config, executor_id, internal_storage, compute_handler, tf_sink_data)
 
         self.remote_invoker = self.config['serverless'].get('remote_invoker', False)
+        self.invoke_engine = self.config['serverless'].get('invoke_engine', 'threads')
+        if self.invoke_engine not in self.INVOKE_ENGINES:
+            raise Exception("Invoke engine '{}' is not available. Available engines: {}"
+                            .format(self.invoke_engine, ', '.join(self.INVOKE_ENGINES)))
+        self.async_invoker = None
         self.use_threads = (self.is_lithops_worker
                             or not is_unix_system()
                             or mp.get_start_method() != 'fork')
         self.invokers = []
         self.ongoing_activations = 0
 
+        # Jobs known by the invoker processes, which only get job indexes
+        # and call indexes through the pending calls queue
+        self.jobs = {}
+        self.job_indexes = {}
+        self.jobs_segments = {}
+        self.jobs_qs = []
+
         if self.use_threads:
             self.token_bucket_q = queue.Queue()
             self.pending_calls_q = queue.Queue()
@@ -181,7 +225,20 @@ class ServerlessInvoker(Invoker):
             self.running_flag = mp.Value('i', 0)
             self.INVOKER = mp.Process
 
-        self.job_monitor = JobMonitor(self.config, self.internal_storage, self.token_bucket_q)
+        # The async invokers of the client and of all the invoker threads or
+        # processes share the max in-flight invocations
+        self.inflight = None
+        if self.invoke_engine == 'asyncio':
+            max_inflight = self.config['serverless'].get('invoke_max_inflight', INVOKE_MAX_INFLIGHT)
+            self.inflight = BoundedSemaphore(max_inflight) if self.use_threads else mp.BoundedSemaphore(max_inflight)
+
+        self.concurrency = None
+        if self.config['serverless'].get('adaptive_concurrency', False):
+            max_limit = self.config['serverless'].get('invoke_max_concurrency', CONCURRENCY_MAX)
+            self.concurrency = ConcurrencyController(max_limit=max_limit, processes=not self.use_threads)
+
+        self.job_monitor = JobMonitor(self.config, self.internal_storage, self.token_bucket_q,
+                                      self.tf_sink_data is not None)
 
         logger.debug('ExecutorID {} - Serverless invoker created'.format(self.executor_id))
 
@@ -225,68 +282,280 @@ class ServerlessInvoker(Invoker):
         """Starts the invoker process responsible to spawn pending calls
         in background.
         """
+        if not self.use_threads:
+            # Processes left by a previous stop must not take calls of jobs they will never get
+            self.pending_calls_q = mp.Queue()
+            self.jobs_qs = []
+
         for inv_id in range(self.INVOKER_PROCESSES):
-            p = self.INVOKER(target=self._run_invoker_process, args=(inv_id, ))
+            # Threads share the jobs registry, processes get the new jobs through their own queue
+            jobs_q = None if self.use_threads else mp.Queue()
+            if jobs_q:
+                self.jobs_qs.append(jobs_q)
+            p = self.INVOKER(target=self._run_invoker_process, args=(inv_id, jobs_q))
             self.invokers.append(p)
             p.daemon = True
             p.start()
 
-    def _run_invoker_process(self, inv_id):
+    def _run_invoker_process(self, inv_id, jobs_q):
         """Run process that implements token bucket scheduling approach"""
         logger.debug('ExecutorID {} - Invoker process {} started'
                      .format(self.executor_id, inv_id))
 
-        with ThreadPoolExecutor(max_workers=250) as executor:
-            while True:
-                try:
-                    self.token_bucket_q.get()
-                    job, call_id = self.pending_calls_q.get()
-                except KeyboardInterrupt:
-                    break
-                if self.running_flag.value:
-                    executor.submit(self._invoke, job, call_id)
-                else:
-                    break
+        if self.invoke_engine == 'asyncio':
+            # Each invoker process runs its own event loop, as loops do not survive a fork
+            async_invoker = self._create_async_invoker()
+            self._consume_pending_calls(jobs_q, lambda job, call_id: async_invoker.submit(
+                self._invoke_async(async_invoker, job, call_id)))
+            async_invoker.stop()
+        else:
+            with ThreadPoolExecutor(max_workers=250) as executor:
+                self._consume_pending_calls(jobs_q, lambda job, call_id: executor.submit(self._invoke, job, call_id))
 
         logger.debug('ExecutorID {} - Invoker process {} finished'
                      .format(self.executor_id, inv_id))
 
-    def _invoke(self, job, call_id):
-        """Method used to perform the actual invocation against the
-        compute backend.
+    def _consume_pending_calls(self, jobs_q, submit):
+        """Submits a pending call each time a token is available. The calls
+        arrive in chunks of consecutive calls of the same job.
         """
-        payload = {'config': self.config,
-                   'log_level': self.log_level,
-                   'func_key': job.func_key,
-                   'data_key': job.data_key,
-                   'extra_env': job.extra_env,
-                   'execution_timeout': job.execution_timeout,
-                   'data_byte_range': job.data_ranges[int(call_id)],
-                   'executor_id': job.executor_id,
-                   'job_id': job.job_id,
-                   'call_id': call_id,
-                   'host_submit_tstamp': time.time(),
-                   'lithops_version': __version__,
-                   'runtime_name': job.runtime_name,
-                   'runtime_memory': job.runtime_memory}
+        pending_calls = deque()
+        while True:
+            try:
+                if not pending_calls:
+                    job_index, call_indexes = self.pending_calls_q.get()
+                    if job_index is not None:
+                        job = self._get_registered_job(jobs_q, job_index, call_indexes[-1])
+                        pending_calls.extend((job, i) for i in call_indexes)
+                self.token_bucket_q.get()
+            except KeyboardInterrupt:
+                break
+            if self.running_flag.value and pending_calls:
+                job, call_index = pending_calls.popleft()
+                submit(job, "{:05d}".format(call_index))
+            else:
+                break
+
+    def _register_job(self, job):
+        """
+        Registers a job in the invoker processes and returns its index. Each
+        time a streaming job grows, only its new segments are sent.
+        """
+        job_key = create_job_key(job.executor_id, job.job_id)
+        if job_key in self.job_indexes and job.segment_first_calls:
+            job_index = self.job_indexes[job_key]
+            update = self._create_job_segments(job, self.jobs_segments[job_index])
+        else:
+            job_index = self.job_indexes.setdefault(job_key, len(self.jobs))
+            update = job
+            if job.segment_first_calls and self.jobs_qs:
+                # The queues pickle the job later, while the next segment may be already growing it
+                update = copy.copy(job)
+                update.segment_first_calls = list(job.segment_first_calls)
+                update.data_keys = list(job.data_keys)
+                update.data_ranges = list(job.data_ranges)
+        self.jobs[job_index] = job
+        self.jobs_segments[job_index] = len(job.segment_first_calls or [])
+        for jobs_q in self.jobs_qs:
+            jobs_q.put((job_index, update))
+        return job_index
+
+    @staticmethod
+    def _create_job_segments(job, first_segment):
+        """
+        Returns the segments of a streaming job from first_segment on, with
+        the attributes of the job that change as it grows
+        """
+        first_call = job.total_calls
+        if first_segment < len(job.segment_first_calls):
+            first_call = job.segment_first_calls[first_segment]
+        return {'first_segment': first_segment,
+                'first_call': first_call,
+                'total_calls': job.total_calls,
+                'total_activations': job.total_activations,
+                'func_key': job.func_key,
+                'segment_first_calls': job.segment_first_calls[first_segment:],
+                'data_keys': job.data_keys[first_segment:],
+                'data_ranges': job.data_ranges[first_call:]}
+
+    @staticmethod
+    def _add_job_segments(job, segments):
+        """
+        Adds the segments of a streaming job to the copy of an invoker process.
+        The segments replace those from the same position on, as a forked
+        process may already have some of them.
+        """
+        first_segment = segments['first_segment']
+        job.total_calls = segments['total_calls']
+        job.total_activations = segments['total_activations']
+        job.func_key = segments['func_key']
+        job.segment_first_calls[first_segment:] = segments['segment_first_calls']
+        job.data_keys[first_segment:] = segments['data_keys']
+        job.data_ranges[segments['first_call']:] = segments['data_ranges']
+
+    def _get_registered_job(self, jobs_q, job_index, call_index):
+        """
+        Returns a registered job that already includes call_index, waiting
+        for it, or for its new segments, in jobs_q if this process does not
+        have it yet
+        """
+        while job_index not in self.jobs or call_index >= self.jobs[job_index].total_calls:
+            index, update = jobs_q.get()
+            if isinstance(update, dict):
+                self._add_job_segments(self.jobs[index], update)
+            else:
+                self.jobs[index] = update
+                self.job_indexes[create_job_key(update.executor_id, update.job_id)] = index
+        return self.jobs[job_index]
+
+    def _put_pending_calls(self, job_index, callids):
+        """Queues a range of call indexes in chunks of consecutive calls"""
+        for i in range(0, len(callids), self.PENDING_CALLS_CHUNK):
+            self.pending_calls_q.put((job_index, callids[i:i+self.PENDING_CALLS_CHUNK]))
+
+    def _requeue_call(self, job, call_id):
+        """Queues again a call rejected by the compute backend"""
+        job_index = self.job_indexes[create_job_key(job.executor_id, job.job_id)]
+        self.pending_calls_q.put((job_index, [int(call_id)]))
+        self.token_bucket_q.put('#')
+
+    def _create_async_invoker(self):
+        max_inflight = self.config['serverless'].get('invoke_max_inflight', INVOKE_MAX_INFLIGHT)
+        pool_size = self.config['serverless'].get('invoke_pool_size', INVOKE_POOL_SIZE)
+        return AsyncInvoker(self.compute_handler, max_inflight=max_inflight, pool_size=pool_size,
+                            inflight=self.inflight)
+
+    def put_job_payload(self, job):
+        """
+        Uploads the part of the payload shared by all the calls of a job,
+        so that each invocation only carries its own fields
+        """
+        job_payload = {'config': self.config,
+                       'extra_env': job.extra_env,
+                       'execution_timeout': job.execution_timeout,
+                       'executor_id': job.executor_id,
+                       'job_id': job.job_id,
+                       'lithops_version': __version__,
+                       'runtime_name': job.runtime_name,
+                       'runtime_memory': job.runtime_memory}
+        payload_key = create_job_payload_key(job.executor_id, job.job_id)
+        self.internal_storage.put_data(payload_key, json.dumps(job_payload))
+        job.payload_key = payload_key
+
+    def create_payload(self, job, call_id):
+        """
+        Creates the payload of a function call
+        """
+        data_key = job.data_key
+        last_call = job.total_calls
+        if job.segment_first_calls:
+            # Each segment of a streaming job has its own data object
+            segment = bisect.bisect_right(job.segment_first_calls, int(call_id)) - 1
+            data_key = job.data_keys[segment]
+            if segment+1 < len(job.segment_first_calls):
+                last_call = job.segment_first_calls[segment+1]
+
+        if job.payload_key:
+            # The rest of the payload is shared by all the calls of the job
+            payload = {'log_level': self.log_level,
+                       'storage_config': self.storage_config,
+                       'job_payload_key': job.payload_key,
+                       'func_key': job.func_key,
+                       'data_key': data_key,
+                       'data_byte_range': job.data_ranges[int(call_id)],
+                       'call_id': call_id,
+                       'host_submit_tstamp': time.time()}
+        else:
+            payload = {'config': self.config,
+                       'log_level': self.log_level,
+                       'func_key': job.func_key,
+                       'data_key': data_key,
+                       'extra_env': job.extra_env,
+                       'execution_timeout': job.execution_timeout,
+                       'data_byte_range': job.data_ranges[int(call_id)],
+                       'executor_id': job.executor_id,
+                       'job_id': job.job_id,
+                       'call_id': call_id,
+                       'host_submit_tstamp': time.time(),
+                       'lithops_version': __version__,
+                       'runtime_name': job.runtime_name,
+                       'runtime_memory': job.runtime_memory}
+
+        if job.batch_size > 1:
+            # The calls of a batch are consecutive, so is their data
+            first = int(call_id)
+            call_ids = ["{:05d}".format(i) for i in range(first, min(first+job.batch_size, last_call))]
+            data_byte_ranges = [job.data_ranges[int(i)] for i in call_ids]
+            payload['call_ids'] = call_ids
+            payload['data_byte_ranges'] = data_byte_ranges
+            payload['data_byte_range'] = (data_byte_ranges[0][0], data_byte_ranges[-1][1])
 
         # ------------------ TRIGGERFLOW -------------------
         subject = '{}/{}/{}'.format(job.executor_id, job.job_id, job.function_name)
+        if call_id in job.trigger_tags:
+            # Calls consumed by a triggered reducer are joined by their own subject
+            subject = '{}:{}'.format(subject, job.trigger_tags[call_id])
         tf_data = {'sink': self.tf_sink_data, 'subject': subject}
         payload.update({'__OW_TRIGGERFLOW': tf_data})
         # --------------------------------------------------
 
+        return payload
+
+    def _invoke(self, job, call_id):
+        """Method used to perform the actual invocation against the
+        compute backend.
+        """
+        payload = self.create_payload(job, call_id)
+
+        if self.concurrency:
+            self.concurrency.acquire()
+
         # do the invocation
         start = time.time()
-        activation_id = self.compute_handler.invoke(job.runtime_name, job.runtime_memory, payload)
-        roundtrip = time.time() - start
+        activation_id = None
+        try:
+            activation_id = self.compute_handler.invoke(job.runtime_name, job.runtime_memory, payload)
+        finally:
+            roundtrip = time.time() - start
+            if self.concurrency:
+                self.concurrency.release(not activation_id, roundtrip)
+        resp_time = format(round(roundtrip, 3), '.3f')
+
+        if not activation_id:
+            # reached quota limit, the adaptive concurrency already slowed down
+            if not self.concurrency:
+                time.sleep(random.randint(0, 5))
+            self._requeue_call(job, call_id)
+            return
+
+        logger.info('ExecutorID {} | JobID {} - Function call {} done! ({}s) - Activation'
+                    ' ID: {}'.format(job.executor_id, job.job_id, call_id, resp_time, activation_id))
+
+    async def _invoke_async(self, async_invoker, job, call_id):
+        """Coroutine counterpart of _invoke, run in the event loop of
+        an async invoker.
+        """
+        payload = self.create_payload(job, call_id)
+
+        if self.concurrency:
+            await self.concurrency.acquire_async()
+
+        # do the invocation
+        start = time.time()
+        activation_id = None
+        try:
+            activation_id = await async_invoker.invoke(job.runtime_name, job.runtime_memory, payload)
+        finally:
+            roundtrip = time.time() - start
+            if self.concurrency:
+                self.concurrency.release(not activation_id, roundtrip)
         resp_time = format(round(roundtrip, 3), '.3f')
 
         if not activation_id:
-            # reached quota limit
-            time.sleep(random.randint(0, 5))
-            self.pending_calls_q.put((job, call_id))
-            self.token_bucket_q.put('#')
+            # reached quota limit, the adaptive concurrency already slowed down
+            if not self.concurrency:
+                await asyncio.sleep(random.randint(0, 5))
+            self._requeue_call(job, call_id)
             return
 
         logger.info('ExecutorID {} | JobID {} - Function call {} done! ({}s) - Activation'
@@ -315,9 +584,10 @@ class ServerlessInvoker(Invoker):
         else:
             raise Exception('Unable to spawn remote invoker')
 
-    def run(self, job):
+    def run(self, job, first_call=0):
         """
-        Run a job described in job_description
+        Run a job described in job_description. The calls before first_call
+        of a streaming job were already invoked.
         """
 
         job.runtime_name = self.runtime_name
@@ -356,21 +626,30 @@ class ServerlessInvoker(Invoker):
                 Use local threads to perform all the function invocations
                 """
                 try:
+                    if first_call == 0:
+                        self.put_job_payload(job)
+
                     if self.running_flag.value == 0:
                         self.ongoing_activations = 0
                         self.running_flag.value = 1
                         self._start_invoker_process()
 
+                    job_index = self._register_job(job)
+
+                    if first_call == 0:
+                        self.job_monitor.start_job_monitoring(job)
+
                     log_msg = ('ExecutorID {} | JobID {} - Starting function '
                                'invocation: {}() - Total: {} activations'
                                .format(job.executor_id, job.job_id,
-                                       job.function_name, job.total_calls))
+                                       job.function_name, job.total_activations))
                     logger.info(log_msg)
                     if not self.log_active:
                         print(log_msg)
 
+                    # Each activation is identified by the first call of its batch
+                    callids = range(first_call, job.total_calls, job.batch_size)
                     if self.ongoing_activations < self.workers:
-                        callids = range(job.total_calls)
                         total_direct = self.workers-self.ongoing_activations
                         callids_to_invoke_direct = callids[:total_direct]
                         callids_to_invoke_nondirect = callids[total_direct:]
@@ -385,11 +664,19 @@ class ServerlessInvoker(Invoker):
                         def _callback(future):
                             future.result()
 
-                        executor = ThreadPoolExecutor(job.invoke_pool_threads)
-                        for i in callids_to_invoke_direct:
-                            call_id = "{:05d}".format(i)
-                            future = executor.submit(self._invoke, job, call_id)
-                            future.add_done_callback(_callback)
+                        if self.invoke_engine == 'asyncio':
+                            if self.async_invoker is None:
+                                self.async_invoker = self._create_async_invoker()
+                            for i in callids_to_invoke_direct:
+                                call_id = "{:05d}".format(i)
+                                future = self.async_invoker.submit(self._invoke_async(self.async_invoker, job, call_id))
+                                future.add_done_callback(_callback)
+                        else:
+                            executor = ThreadPoolExecutor(job.invoke_pool_threads)
+                            for i in callids_to_invoke_direct:
+                                call_id = "{:05d}".format(i)
+                                future = executor.submit(self._invoke, job, call_id)
+                                future.add_done_callback(_callback)
                         time.sleep(0.1)
 
                         # Put into the queue the rest of the callids to invoke within the process
@@ -398,35 +685,19 @@ class ServerlessInvoker(Invoker):
                                          '{} function invocations into pending queue'
                                          .format(job.executor_id, job.job_id,
                                                  len(callids_to_invoke_nondirect)))
-                            for i in callids_to_invoke_nondirect:
-                                call_id = "{:05d}".format(i)
-                                self.pending_calls_q.put((job, call_id))
+                            self._put_pending_calls(job_index, callids_to_invoke_nondirect)
                     else:
                         logger.debug('ExecutorID {} | JobID {} - Ongoing activations '
                                      'reached {} workers, queuing {} function invocations'
                                      .format(job.executor_id, job.job_id, self.workers,
-                                             job.total_calls))
-                        for i in range(job.total_calls):
-                            call_id = "{:05d}".format(i)
-                            self.pending_calls_q.put((job, call_id))
-
-                    self.job_monitor.start_job_monitoring(job)
+                                             job.total_activations))
+                        self._put_pending_calls(job_index, callids)
 
                 except (KeyboardInterrupt, Exception) as e:
                     self.stop()
                     raise e
 
-        # Create all futures
-        futures = []
-        for i in range(job.total_calls):
-            call_id = "{:05d}".format(i)
-            fut = ResponseFuture(call_id, job,
-                                 job.metadata.copy(),
-                                 self.storage_config)
-            fut._set_state(ResponseFuture.State.Invoked)
-            futures.append(fut)
-
-        return futures
+        return self.create_futures(job, first_call)
 
     def stop(self):
         """
@@ -435,6 +706,14 @@ class ServerlessInvoker(Invoker):
 
         self.job_monitor.stop()
 
+        if self.concurrency:
+            logger.debug('ExecutorID {} - Adaptive concurrency: {}'
+                         .format(self.executor_id, self.concurrency.metrics()))
+
+        if self.async_invoker:
+            self.async_invoker.stop()
+            self.async_invoker = None
+
         if self.invokers:
             logger.debug('ExecutorID {} - Stopping invoker'
                          .format(self.executor_id))
@@ -454,7 +733,7 @@ class ServerlessInvoker(Invoker):
 
 class JobMonitor:
 
-    def __init__(self, lithops_config, internal_storage, token_bucket_q):
+    def __init__(self, lithops_config, internal_storage, token_bucket_q, event_sourcing=False):
         self.config = lithops_config
         self.internal_storage = internal_storage
         self.token_bucket_q = token_bucket_q
@@ -465,6 +744,17 @@ class JobMonitor:
         if self.rabbitmq_monitor:
             self.rabbit_amqp_url = self.config['rabbitmq'].get('amqp_url')
 
+        # ------------------ TRIGGERFLOW -------------------
+        self.event_monitor = self.config.get('triggerflow', {}).get('event_monitor', False)
+        if self.event_monitor and not event_sourcing:
+            # The functions only send termination events with event sourcing enabled
+            logger.warning('The event monitor requires event sourcing, monitoring the jobs '
+                           'from the storage instead')
+            self.event_monitor = False
+        if self.event_monitor and self.config['triggerflow']['sink'] not in ['redis', 'kafka']:
+            raise Exception("The event monitor requires a 'redis' or 'kafka' Triggerflow sink")
+        # --------------------------------------------------
+
     def stop(self):
         for job_key in self.monitors:
             self.monitors[job_key]['should_run'] = False
@@ -481,6 +771,11 @@ class JobMonitor:
                      .format(job.executor_id, job.job_id))
         if self.rabbitmq_monitor:
             th = Thread(target=self._job_monitoring_rabbitmq, args=(job,))
+        elif self.event_monitor:
+            # The position is taken before the calls are invoked, so no event is missed
+            event_source = self._create_event_source(job.executor_id)
+            event_source = self._create_event_source(job.executor_id, event_source.get_last_cursor())
+            th = Thread(target=self._job_monitoring_events, args=(job, event_source))
         else:
             th = Thread(target=self._job_monitoring_os, args=(job,))
 
@@ -495,9 +790,12 @@ class JobMonitor:
         total_callids_done = 0
         job_key = create_job_key(job.executor_id, job.job_id)
 
-        while self.monitors[job_key]['should_run'] and total_callids_done < job.total_calls:
+        while self.monitors[job_key]['should_run'] and \
+                (total_callids_done < job.total_activations or job.streaming):
             time.sleep(1)
             callids_running, callids_done = self.internal_storage.get_job_status(job.executor_id, job.job_id)
+            # A batch activation finishes when the status of its first call is stored
+            callids_done = [c for c in callids_done if is_first_call_of_batch(job, int(c[2]))]
             total_new_tokens = len(callids_done) - total_callids_done
             total_callids_done = total_callids_done + total_new_tokens
             for i in range(total_new_tokens):
@@ -523,13 +821,43 @@ class JobMonitor:
         def callback(ch, method, properties, body):
             nonlocal total_callids_done
             call_status = json.loads(body.decode("utf-8"))
-            if call_status['type'] == '__end__':
+            if call_status['type'] == '__end__' and is_first_call_of_batch(job, int(call_status['call_id'])):
                 if self.monitors[job_key]['should_run']:
                     self.token_bucket_q.put('#')
                 total_callids_done += 1
-            if total_callids_done == job.total_calls or \
+            if (total_callids_done == job.total_activations and not job.streaming) or \
                not self.monitors[job_key]['should_run']:
                 ch.stop_consuming()
 
         channel.basic_consume(callback, queue=queue_1, no_ack=True)
         channel.start_consuming()
+
+    # ------------------ TRIGGERFLOW -------------------
+    def _create_event_source(self, executor_id, cursor=None):
+        if self.config['triggerflow']['sink'] == 'kafka':
+            return KafkaEventSource(self.config['kafka'], executor_id, cursor)
+        return RedisEventSource(self.config['redis'], executor_id, cursor)
+
+    def _job_monitoring_events(self, job, event_source):
+        """
+        Returns a token as soon as the termination event of each activation
+        reaches the Triggerflow sink, instead of listing the job status
+        """
+        total_callids_done = 0
+        job_key = create_job_key(job.executor_id, job.job_id)
+
+        events = event_source.follow_events(EVENT_MONITOR_TIMEOUT)
+        for call_status in events:
+            if call_status and call_status['job_id'] == job.job_id and \
+               is_first_call_of_batch(job, int(call_status['call_id'])):
+                if self.monitors[job_key]['should_run']:
+                    self.token_bucket_q.put('#')
+                total_callids_done += 1
+            if (total_callids_done == job.total_activations and not job.streaming) or \
+               not self.monitors[job_key]['should_run']:
+                break
+        events.close()
+
+        logger.debug('ExecutorID {} - | JobID {} -Job monitoring finished'
+                     .format(job.executor_id,  job.job_id))
+    # --------------------------------------------------
@@ -0,0 +1,5 @@
+from .job import create_map_job
+from .job import create_map_job_stream
+from .job import create_reduce_job
+from .job import create_reduce_tree
+from .pipeline import create_pipeline
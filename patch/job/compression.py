@@ -0,0 +1,46 @@
+#
+# (C) Copyright IBM Corp. 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import zlib
+
+CODECS = {'zlib': (zlib.compress, zlib.decompress)}
+
+try:
+    import lz4.frame
+    CODECS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    CODECS['zstd'] = (lambda data: zstandard.ZstdCompressor().compress(data),
+                      lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+
+
+def check_codec(codec):
+    if codec not in CODECS:
+        raise Exception("Compression codec '{}' is not available. Available codecs: {}"
+                        .format(codec, ', '.join(CODECS)))
+
+
+def compress(data, codec):
+    return CODECS[codec][0](data)
+
+
+def decompress(data, codec):
+    return CODECS[codec][1](data)
@@ -16,26 +16,42 @@
 #
 
 
+import copy
+import math
 import time
 import pickle
+import hashlib
 import logging
+from email.utils import parsedate_to_datetime
 from lithops import utils
 from lithops.job.partitioner import create_partitions
 from lithops.utils import is_object_processing_function, sizeof_fmt
-from lithops.storage.utils import create_func_key, create_agg_data_key
-from lithops.job.serialize import SerializeIndependent, create_module_data
+from lithops.storage.utils import create_agg_data_key, create_job_key, StorageNoSuchKeyError
+from lithops.job.serialize import SerializeIndependent, create_module_data, serialization_cache
+from lithops.job.upload import DataUploader
+from lithops.job.compression import check_codec, compress
+from lithops.job.spill import DATA_SPILL_SIZE, create_spill_key, put_argument, spill_arguments
 from lithops.constants import MAX_AGG_DATA_SIZE, JOBS_PREFIX, LOCALHOST,\
     SERVERLESS, STANDALONE
 from types import SimpleNamespace
 
 logger = logging.getLogger(__name__)
 
+FUNCS_PREFIX = JOBS_PREFIX + '/functions'
+# Functions last uploaded before this many seconds are uploaded again when reused
+FUNCS_REFRESH_PERIOD = 24 * 3600
+# Functions last uploaded before this many seconds are deleted by the cleaner
+FUNCS_RETENTION_PERIOD = 2 * FUNCS_REFRESH_PERIOD
+
+MAP_SEGMENT_SIZE = 1000
+
 
 def create_map_job(config, internal_storage, executor_id, job_id, map_function,
                    iterdata, runtime_meta, runtime_memory, extra_env,
                    include_modules, exclude_modules, execution_timeout,
                    extra_args=None,  obj_chunk_size=None, obj_chunk_number=None,
-                   invoke_pool_threads=128, already_invoked=False):
+                   invoke_pool_threads=128, already_invoked=False, batch_size=1,
+                   segment=None, first_call=0):
     """
     Wrapper to create a map job.  It integrates COS logic to process objects.
     """
@@ -43,6 +59,15 @@ def create_map_job(config, internal_storage, executor_id, job_id, map_function,
     host_job_meta = {'host_job_create_tstamp': time.time()}
     map_iterdata = utils.verify_args(map_function, iterdata, extra_args)
 
+    # The extra args are the same for all the calls, so they are uploaded once
+    shared_args = None
+    if extra_args and map_iterdata:
+        if type(extra_args) is dict:
+            shared_names = list(extra_args)
+        else:
+            shared_names = list(map_iterdata[0])[-len(extra_args):]
+        shared_args = {name: map_iterdata[0][name] for name in shared_names}
+
     if config['lithops'].get('rabbitmq_monitor', False):
         rabbit_amqp_url = config['rabbitmq'].get('amqp_url')
         utils.create_rabbitmq_resources(rabbit_amqp_url, executor_id, job_id)
@@ -60,6 +85,11 @@ def create_map_job(config, internal_storage, executor_id, job_id, map_function,
         host_job_meta['host_job_create_partitions_time'] = round(time.time()-create_partitions_start, 6)
     # ########
 
+    if shared_args:
+        # New dicts per call, the caller may still use its iterdata
+        map_iterdata = [{k: v for k, v in data_i.items() if k not in shared_args}
+                        for data_i in map_iterdata]
+
     job = _create_job(config=config,
                       internal_storage=internal_storage,
                       executor_id=executor_id,
@@ -74,7 +104,11 @@ def create_map_job(config, internal_storage, executor_id, job_id, map_function,
                       execution_timeout=execution_timeout,
                       host_job_meta=host_job_meta,
                       invoke_pool_threads=invoke_pool_threads,
-                      already_invoked=already_invoked)
+                      already_invoked=already_invoked,
+                      shared_args=shared_args,
+                      batch_size=batch_size,
+                      segment=segment,
+                      first_call=first_call)
 
     if parts_per_object:
         job.parts_per_object = parts_per_object
@@ -82,24 +116,146 @@ def create_map_job(config, internal_storage, executor_id, job_id, map_function,
     return job
 
 
-def create_reduce_job(config, internal_storage, executor_id, reduce_job_id,
-                      reduce_function, map_job, map_futures, runtime_meta,
-                      runtime_memory, reducer_one_per_object, extra_env,
-                      include_modules, exclude_modules, execution_timeout=None,
-                      already_invoked=False):
+def create_map_job_stream(config, internal_storage, executor_id, job_id, map_function,
+                          iterdata, runtime_meta, runtime_memory, extra_env,
+                          include_modules, exclude_modules, execution_timeout,
+                          extra_args=None, obj_chunk_size=None, obj_chunk_number=None,
+                          invoke_pool_threads=128, already_invoked=False, batch_size=1,
+                          segment_size=None):
     """
-    Wrapper to create a reduce job. Apply a function across all map futures.
+    Creates a map job from an iterator, without materializing it. The data
+    is uploaded in segments of segment_size elements, each one in its own
+    object. Yields the job each time a segment is uploaded, with the calls
+    of the segment appended, together with the index of its first call.
     """
-    host_job_meta = {'host_job_create_tstamp': time.time()}
+    segment_size = segment_size or config['lithops'].get('map_segment_size', MAP_SEGMENT_SIZE)
+
+    job = None
+    for segment, segment_iterdata in enumerate(_iter_segments(iterdata, segment_size)):
+        first_call = job.total_calls if job else 0
+        segment_job = create_map_job(config, internal_storage, executor_id, job_id,
+                                     map_function=map_function,
+                                     iterdata=segment_iterdata,
+                                     runtime_meta=runtime_meta,
+                                     runtime_memory=runtime_memory,
+                                     extra_env=extra_env,
+                                     include_modules=include_modules,
+                                     exclude_modules=exclude_modules,
+                                     execution_timeout=execution_timeout,
+                                     extra_args=extra_args,
+                                     obj_chunk_size=obj_chunk_size,
+                                     obj_chunk_number=obj_chunk_number,
+                                     invoke_pool_threads=invoke_pool_threads,
+                                     already_invoked=already_invoked,
+                                     batch_size=batch_size,
+                                     segment=segment,
+                                     first_call=first_call)
+        if job is None:
+            job = copy.copy(segment_job)
+            job.streaming = True
+            job.segment_first_calls = []
+            job.data_keys = []
+            job.data_ranges = []
+        else:
+            job.total_calls += segment_job.total_calls
+            job.total_activations += segment_job.total_activations
+            job.metadata = segment_job.metadata
+        job.segment_first_calls.append(first_call)
+        if not already_invoked:
+            # Modules found in the data of the segment may change the function
+            job.func_key = segment_job.func_key
+            job.data_keys.append(segment_job.data_key)
+            job.data_ranges.extend(segment_job.data_ranges)
+        logger.debug('ExecutorID {} | JobID {} - Segment {} created - Total: {} calls'
+                     .format(executor_id, job_id, segment, job.total_calls))
+        yield job, first_call
+
+
+def _iter_segments(iterdata, segment_size):
+    segment = []
+    for data_i in iterdata:
+        segment.append(data_i)
+        if len(segment) == segment_size:
+            yield segment
+            segment = []
+    if segment:
+        yield segment
+
+
+def create_segment_data_key(executor_id, job_id, segment):
+    return '/'.join([JOBS_PREFIX, create_job_key(executor_id, job_id), 'aggdata-{:05d}.pickle'.format(segment)])
+
 
-    iterdata = [[map_futures, ]]
+def create_job_payload_key(executor_id, job_id):
+    return '/'.join([JOBS_PREFIX, create_job_key(executor_id, job_id), 'payload.json'])
 
+
+def _get_reducer_inputs(map_job, reducer_one_per_object):
+    """
+    Returns the indexes of the map calls consumed by each final reducer
+    """
     if hasattr(map_job, 'parts_per_object') and reducer_one_per_object:
         prev_total_partitons = 0
-        iterdata = []
+        reducer_inputs = []
         for total_partitions in map_job.parts_per_object:
-            iterdata.append([map_futures[prev_total_partitons:prev_total_partitons+total_partitions]])
+            reducer_inputs.append(list(range(prev_total_partitons, prev_total_partitons+total_partitions)))
             prev_total_partitons = prev_total_partitons + total_partitions
+        return reducer_inputs
+
+    return [list(range(map_job.total_calls))]
+
+
+def create_reduce_tree(map_job, reducer_one_per_object, reducer_fanin=None):
+    """
+    Plans a k-ary reduce tree over the map calls. Returns one list of reducers
+    per level, each reducer being the list of its (level, call index) inputs,
+    where level 0 are the map calls. The last level holds the final reducers.
+    """
+    reducers = [[(0, i) for i in inputs] for inputs in _get_reducer_inputs(map_job, reducer_one_per_object)]
+    if reducer_fanin is None:
+        return [reducers]
+    if reducer_fanin < 2:
+        raise Exception('The reducer fan-in must be at least 2')
+
+    levels = []
+    while any(len(inputs) > reducer_fanin for inputs in reducers):
+        level = []
+        next_reducers = []
+        for inputs in reducers:
+            if len(inputs) <= reducer_fanin:
+                next_reducers.append(inputs)
+                continue
+            outputs = []
+            for i in range(0, len(inputs), reducer_fanin):
+                if len(inputs[i:i+reducer_fanin]) == 1:
+                    # A single remaining input goes straight to the next level
+                    outputs.append(inputs[i])
+                    continue
+                outputs.append((len(levels)+1, len(level)))
+                level.append(inputs[i:i+reducer_fanin])
+            next_reducers.append(outputs)
+        levels.append(level)
+        reducers = next_reducers
+    levels.append(reducers)
+
+    return levels
+
+
+def create_reduce_job(config, internal_storage, executor_id, reduce_job_id,
+                      reduce_function, map_job, map_futures, runtime_meta,
+                      runtime_memory, reducer_one_per_object, extra_env,
+                      include_modules, exclude_modules, execution_timeout=None,
+                      already_invoked=False, reducer_futures=None):
+    """
+    Wrapper to create a reduce job. Apply a function across all map futures,
+    or across each list of futures of reducer_futures, one reducer per list.
+    """
+    host_job_meta = {'host_job_create_tstamp': time.time()}
+
+    if reducer_futures is None:
+        reducer_futures = [[map_futures[i] for i in inputs]
+                           for inputs in _get_reducer_inputs(map_job, reducer_one_per_object)]
+    iterdata = [[futures, ] for futures in reducer_futures]
 
     reduce_job_env = {'__PW_REDUCE_JOB': True}
     if extra_env is None:
@@ -126,10 +282,37 @@ def create_reduce_job(config, internal_storage, executor_id, reduce_job_id,
                        already_invoked=already_invoked)
 
 
+def create_func_key(func_module_str):
+    """
+    Creates the content-addressed key of a function and its modules
+    """
+    func_hash = hashlib.sha256(func_module_str).hexdigest()
+    return '/'.join([FUNCS_PREFIX, '{}.pickle'.format(func_hash)])
+
+
+def _func_uploaded(internal_storage, func_key):
+    """
+    Checks if the function is in the storage. The functions are shared by all
+    the executors, so clean() keeps them, and the cleaner deletes those last
+    uploaded more than FUNCS_RETENTION_PERIOD ago. A function last uploaded
+    more than FUNCS_REFRESH_PERIOD ago is reported as missing, so that it is
+    uploaded again and does not expire while in use.
+    """
+    try:
+        metadata = internal_storage.storage.head_object(internal_storage.bucket, func_key)
+    except StorageNoSuchKeyError:
+        return False
+    last_modified = metadata.get('last-modified') if hasattr(metadata, 'get') else None
+    if last_modified:
+        return time.time() - parsedate_to_datetime(last_modified).timestamp() < FUNCS_REFRESH_PERIOD
+    return True
+
+
 def _create_job(config, internal_storage, executor_id, job_id, func,
                 iterdata, runtime_meta, runtime_memory, extra_env,
                 include_modules, exclude_modules, execution_timeout,
-                host_job_meta, invoke_pool_threads=128, already_invoked=False):
+                host_job_meta, invoke_pool_threads=128, already_invoked=False,
+                shared_args=None, batch_size=1, segment=None, first_call=0):
     """
     :param func: the function to map over the data
     :param iterdata: An iterable of input data
@@ -140,6 +323,10 @@ def _create_job(config, internal_storage, executor_id, job_id, func,
     :param data_all_as_one: upload the data as a single object. Default True
     :param overwrite_invoke_args: Overwrite other args. Mainly used for testing.
     :param exclude_modules: Explicitly keep these modules from pickled dependencies.
+    :param shared_args: Arguments common to all the calls, uploaded once for the whole job.
+    :param batch_size: Number of calls run by each function activation.
+    :param segment: Index of the segment of a streaming map job, uploaded in its own object.
+    :param first_call: Index of the first call of the segment within the job.
     :return: A list with size `len(iterdata)` of futures for each job
     :rtype:  list of futures.
     """
@@ -157,6 +344,11 @@ def _create_job(config, internal_storage, executor_id, job_id, func,
     job.execution_timeout = execution_timeout or config['lithops']['execution_timeout']
     job.function_name = func.__name__
     job.total_calls = len(iterdata)
+    job.batch_size = max(1, batch_size or 1)
+    job.total_activations = math.ceil(job.total_calls / job.batch_size)
+    job.streaming = False
+    job.segment_first_calls = None
+    job.payload_key = None
 
     mode = config['lithops']['mode']
 
@@ -178,6 +370,7 @@ def _create_job(config, internal_storage, executor_id, job_id, func,
         job.runtime_timeout = execution_timeout
 
     job.already_invoked = already_invoked
+    job.trigger_tags = {}
 
     if not already_invoked:
         exclude_modules_cfg = config['lithops'].get('exclude_modules', [])
@@ -201,28 +394,91 @@ def _create_job(config, internal_storage, executor_id, job_id, func,
         logger.debug('ExecutorID {} | JobID {} - Serializing function and data'.format(executor_id, job_id))
         job_serialize_start = time.time()
         serializer = SerializeIndependent(runtime_meta['preinstalls'])
-        func_and_data_ser, mod_paths = serializer([func] + iterdata, inc_modules, exc_modules)
-        data_strs = func_and_data_ser[1:]
-        data_size_bytes = sum(len(x) for x in data_strs)
-        module_data = create_module_data(mod_paths)
-        func_str = func_and_data_ser[0]
-        func_module_str = pickle.dumps({'func': func_str, 'module_data': module_data}, -1)
-        func_module_size_bytes = len(func_module_str)
-        total_size = utils.sizeof_fmt(data_size_bytes+func_module_size_bytes)
-        host_job_meta['host_job_serialize_time'] = round(time.time()-job_serialize_start, 6)
-
-        host_job_meta['data_size_bytes'] = data_size_bytes
-        host_job_meta['func_module_size_bytes'] = func_module_size_bytes
+        # The function and its modules are serialized once per fingerprint
+        cache_key = serialization_cache.get_key(func, runtime_meta['preinstalls'], inc_modules, exc_modules)
+        cached_func = serialization_cache.get(cache_key) if cache_key else None
+        host_job_meta['host_func_serialize_cached'] = cached_func is not None
+        if cached_func is None:
+            func_ser, func_mod_paths = serializer([func], inc_modules, exc_modules)
+            func_module_str = pickle.dumps({'func': func_ser[0],
+                                            'module_data': create_module_data(func_mod_paths)}, -1)
+            cached_func = {'func': func_ser[0], 'mod_paths': func_mod_paths, 'func_module_str': func_module_str}
+            if cache_key:
+                serialization_cache.put(cache_key, cached_func)
+        func_serialize_time = time.time()-job_serialize_start
 
         if 'data_limit' in config['lithops']:
             data_limit = config['lithops']['data_limit']
         else:
             data_limit = MAX_AGG_DATA_SIZE
 
-        if data_limit and data_size_bytes > data_limit*1024**2:
-            log_msg = ('ExecutorID {} | JobID {} - Total data exceeded maximum size '
-                       'of {}'.format(executor_id, job_id, sizeof_fmt(data_limit*1024**2)))
-            raise Exception(log_msg)
+        # Upload data while it is serialized
+        if segment is None:
+            data_key = create_agg_data_key(JOBS_PREFIX, executor_id, job_id)
+        else:
+            data_key = create_segment_data_key(executor_id, job_id, segment)
+        job.data_key = data_key
+        data_upload_start = time.time()
+        data_uploader = DataUploader(internal_storage, data_key)
+        serializer_processes = config['lithops'].get('serializer_processes', 0)
+        data_serialize_time = 0
+        data_size_bytes = 0
+        # Each call data is compressed on its own, so its byte range stays valid
+        data_codec = config['lithops'].get('data_compression')
+        if data_codec:
+            check_codec(data_codec)
+            job.extra_env['__PW_DATA_CODEC'] = data_codec
+
+        # Arguments bigger than the spill size are stored in their own objects
+        data_spill_size = config['lithops'].get('data_spill_size', DATA_SPILL_SIZE)
+        data_spill_size = data_spill_size*1024**2 if data_spill_size else None
+
+        if shared_args and not segment:
+            shared_args_str, shared_mod_paths = serializer([shared_args], inc_modules, exc_modules)
+            put_argument(internal_storage, create_spill_key(executor_id, job_id, 'shared'),
+                         shared_args_str[0], data_codec)
+            host_job_meta['shared_args_size_bytes'] = len(shared_args_str[0])
+        if shared_args:
+            job.extra_env['__PW_SHARED_ARGS_KEY'] = create_spill_key(executor_id, job_id, 'shared')
+
+        try:
+            data_serialize_start = time.time()
+            for i, data_str in enumerate(serializer.iter_serialize_parallel(iterdata, inc_modules, exc_modules,
+                                                                            serializer_processes)):
+                if data_spill_size and len(data_str) > data_spill_size:
+                    data_str = spill_arguments(internal_storage, executor_id, job_id, '{:05d}'.format(first_call+i),
+                                               iterdata[i], data_spill_size, data_codec)
+                data_size_bytes += len(data_str)
+                if data_codec:
+                    data_str = compress(data_str, data_codec)
+                data_serialize_time += time.time()-data_serialize_start
+                data_uploader.write(data_str)
+                if data_limit and data_uploader.size > data_limit*1024**2:
+                    log_msg = ('ExecutorID {} | JobID {} - Total data exceeded maximum size '
+                               'of {}'.format(executor_id, job_id, sizeof_fmt(data_limit*1024**2)))
+                    raise Exception(log_msg)
+                data_serialize_start = time.time()
+            data_serialize_time += time.time()-data_serialize_start
+            job.data_ranges = data_uploader.close()
+        except Exception as e:
+            data_uploader.abort()
+            raise e
+        data_upload_end = time.time()
+
+        host_job_meta['host_job_serialize_time'] = round(func_serialize_time+data_serialize_time, 6)
+        host_job_meta['host_data_upload_time'] = round(data_upload_end-data_upload_start-data_serialize_time, 6)
+
+        func_module_str = cached_func['func_module_str']
+        data_mod_paths = serializer.mod_paths | (shared_mod_paths if shared_args and not segment else set())
+        if not data_mod_paths.issubset(cached_func['mod_paths']):
+            module_data = create_module_data(cached_func['mod_paths'] | data_mod_paths)
+            func_module_str = pickle.dumps({'func': cached_func['func'], 'module_data': module_data}, -1)
+        func_module_size_bytes = len(func_module_str)
+        total_size = utils.sizeof_fmt(data_uploader.size+func_module_size_bytes)
+
+        host_job_meta['data_size_bytes'] = data_size_bytes
+        host_job_meta['data_upload_size_bytes'] = data_uploader.size
+        host_job_meta['func_module_size_bytes'] = func_module_size_bytes
 
         log_msg = ('ExecutorID {} | JobID {} - Uploading function and data '
                    '- Total: {}'.format(executor_id, job_id, total_size))
@@ -230,22 +486,15 @@ def _create_job(config, internal_storage, executor_id, job_id, func,
         if not log_level:
             print(log_msg)
 
-        # Upload data
-        data_key = create_agg_data_key(JOBS_PREFIX, executor_id, job_id)
-        job.data_key = data_key
-        data_bytes, data_ranges = utils.agg_data(data_strs)
-        job.data_ranges = data_ranges
-        data_upload_start = time.time()
-        internal_storage.put_data(data_key, data_bytes)
-        data_upload_end = time.time()
-
-        host_job_meta['host_data_upload_time'] = round(data_upload_end-data_upload_start, 6)
-
-        # Upload function and modules
+        # Upload function and modules, unless the same ones were already uploaded
         func_upload_start = time.time()
-        func_key = create_func_key(JOBS_PREFIX, executor_id, job_id)
+        func_key = create_func_key(func_module_str)
         job.func_key = func_key
-        internal_storage.put_func(func_key, func_module_str)
+        if _func_uploaded(internal_storage, func_key):
+            logger.debug('ExecutorID {} | JobID {} - Function and modules already '
+                         'uploaded'.format(executor_id, job_id))
+        else:
+            internal_storage.put_func(func_key, func_module_str)
         func_upload_end = time.time()
 
         host_job_meta['host_func_upload_time'] = round(func_upload_end - func_upload_start, 6)
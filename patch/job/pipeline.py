@@ -0,0 +1,39 @@
+#
+# (C) Copyright IBM Corp. 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+def create_pipeline(stages):
+    """
+    Fuses element-wise stages into a single function that runs them back to
+    back, each one over the output of the previous one. The function takes
+    the arguments of the first stage and returns the output of the last one.
+    """
+    if not stages:
+        raise Exception('A pipeline needs at least one stage')
+
+    first_stage, next_stages = stages[0], tuple(stages[1:])
+
+    def pipeline(*args, **kwargs):
+        result = first_stage(*args, **kwargs)
+        for stage in next_stages:
+            result = stage(result)
+        return result
+
+    # The data of the calls is verified against the signature of the first stage
+    pipeline.__wrapped__ = first_stage
+    pipeline.__name__ = '_'.join(stage.__name__ for stage in stages)
+
+    return pipeline
@@ -0,0 +1,335 @@
+#
+# Copyright 2018 PyWren Team
+# (C) Copyright IBM Corp. 2019
+# (C) Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import glob
+import types
+import pickle
+import hashlib
+import logging
+import multiprocessing as mp
+from pathlib import Path
+from collections import OrderedDict
+from io import BytesIO as StringIO
+from lithops.utils import bytes_to_b64str
+from lithops.libs.cloudpickle import CloudPickler
+from lithops.libs.multyvac.module_dependency import ModuleDependencyAnalyzer
+
+
+logger = logging.getLogger(__name__)
+
+SERIALIZATION_CACHE_SIZE = 64
+SHARDS_PER_PROCESS = 8
+
+# Pool of serialization processes, forked before the invoker threads start
+_serialization_pool = None
+
+
+def start_serialization_pool(processes):
+    """
+    Forks the pool of processes used by iter_serialize_parallel. Forking a
+    process with running threads may deadlock the children on the locks
+    those threads held, so the pool is started once per process, before the
+    first executor starts its threads.
+    """
+    global _serialization_pool
+
+    if _serialization_pool is None and processes >= 2 and 'fork' in mp.get_all_start_methods():
+        logger.debug("Starting {} serialization processes".format(processes))
+        _serialization_pool = mp.get_context('fork').Pool(processes)
+
+
+class SerializeIndependent:
+
+    def __init__(self, preinstalls):
+        # Copied, so the runtime metadata is not modified
+        self.preinstalled_modules = preinstalls + [['lithops', True]]
+        self._modulemgr = None
+        self.mod_paths = set()
+
+    def __call__(self, list_of_objs, include_modules, exclude_modules):
+        """
+        Serialize f, args, kwargs independently
+        """
+        strs = list(self.iter_serialize(list_of_objs, include_modules, exclude_modules))
+
+        return (strs, self.mod_paths)
+
+    def iter_serialize_parallel(self, list_of_objs, include_modules, exclude_modules, processes):
+        """
+        Same as iter_serialize, but the objects are split in contiguous shards
+        that the serialization pool serializes in parallel. The shards are
+        yielded in order, so the result is the same as serializing sequentially.
+        The objects are sent to the pool with the standard pickle, so if it
+        cannot pickle them they are serialized sequentially.
+        """
+        pool = _serialization_pool
+        if pool is None or processes < 2 or len(list_of_objs) < processes:
+            yield from self.iter_serialize(list_of_objs, include_modules, exclude_modules)
+            return
+
+        shard_size = -(-len(list_of_objs) // (processes * SHARDS_PER_PROCESS))
+        shards = [(start, min(start + shard_size, len(list_of_objs)))
+                  for start in range(0, len(list_of_objs), shard_size)]
+        try:
+            shards_data = [pickle.dumps(list_of_objs[start:end], -1) for start, end in shards]
+        except Exception as e:
+            logger.debug("Unable to send the objects to the serialization processes: {}".format(e))
+            yield from self.iter_serialize(list_of_objs, include_modules, exclude_modules)
+            return
+        logger.debug("Serializing {} objects in {} shards with {} processes"
+                     .format(len(list_of_objs), len(shards), processes))
+
+        mod_paths = set()
+        tasks = [(self.preinstalled_modules, shard_data, include_modules, exclude_modules)
+                 for shard_data in shards_data]
+        for (start, end), result in zip(shards, pool.imap(_serialize_shard, tasks)):
+            if result is None:
+                # The classes of the objects did not exist when the pool was forked
+                result = list(self.iter_serialize(list_of_objs[start:end], include_modules,
+                                                  exclude_modules)), self.mod_paths
+            strs, shard_mod_paths = result
+            mod_paths.update(shard_mod_paths)
+            yield from strs
+
+        self.mod_paths = mod_paths
+
+    def iter_serialize(self, list_of_objs, include_modules, exclude_modules):
+        """
+        Serialize the objects one by one. The modules to transmit are in
+        'mod_paths' once all of them are serialized
+        """
+        self._modulemgr = ModuleDependencyAnalyzer()
+        preinstalled_modules = [name for name, _ in self.preinstalled_modules]
+        self._modulemgr.ignore(preinstalled_modules)
+        if not include_modules:
+            self._modulemgr.ignore(exclude_modules)
+
+        direct_modules = set()
+        for obj in list_of_objs:
+            file = StringIO()
+            try:
+                cp = CloudPickler(file)
+                cp.dump(obj)
+                obj_str = file.getvalue()
+            finally:
+                file.close()
+
+            # Add modules
+            for module in cp.modules:
+                try:
+                    direct_modules.add(module.__file__)
+                except Exception:
+                    pass
+                self._modulemgr.add(module.__name__)
+
+            yield obj_str
+
+        logger.debug("Referenced modules: {}"
+                     .format(None if not direct_modules else direct_modules))
+
+        mod_paths = set()
+        if include_modules is not None:
+            tent_mod_paths = self._modulemgr.get_and_clear_paths()
+            if include_modules:
+                logger.debug("Tentative modules to transmit: {}"
+                             .format(None if not tent_mod_paths else tent_mod_paths))
+                logger.debug("Filtering modules: {}".format(include_modules))
+                for im in include_modules:
+                    for mod_path in tent_mod_paths:
+                        if im in mod_path:
+                            mod_paths.add(mod_path)
+                            break
+            else:
+                mod_paths = tent_mod_paths
+
+        logger.debug("Modules to transmit: {}"
+                     .format(None if not mod_paths else mod_paths))
+
+        self.mod_paths = mod_paths
+
+
+def _serialize_shard(task):
+    preinstalled_modules, shard_data, include_modules, exclude_modules = task
+    try:
+        list_of_objs = pickle.loads(shard_data)
+    except Exception:
+        return None
+    serializer = SerializeIndependent([])
+    serializer.preinstalled_modules = preinstalled_modules
+    strs = list(serializer.iter_serialize(list_of_objs, include_modules, exclude_modules))
+    return strs, serializer.mod_paths
+
+
+def create_module_data(mod_paths):
+
+    module_data = {}
+    # load mod paths
+    for m in mod_paths:
+        if os.path.isdir(m):
+            files = glob.glob(os.path.join(m, "**/*.py"), recursive=True)
+            pkg_root = os.path.abspath(os.path.dirname(m))
+        else:
+            pkg_root = os.path.abspath(os.path.dirname(m))
+            files = [m]
+        for f in files:
+            f = os.path.abspath(f)
+            with open(f, 'rb') as file:
+                mod_str = file.read()
+            dest_filename = Path(f[len(pkg_root)+1:]).as_posix()
+            module_data[dest_filename] = bytes_to_b64str(mod_str)
+
+    return module_data
+
+
+class SerializationCache:
+    """
+    LRU cache of serialized functions with their modules, keyed on the
+    function fingerprint, the module filters and the runtime preinstalls.
+    'dirty' tells whether entries were added since the last dumps().
+    """
+    def __init__(self, maxsize=SERIALIZATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.dirty = False
+        self._entries = OrderedDict()
+
+    def get_key(self, func, preinstalls, include_modules, exclude_modules):
+        """
+        Returns the cache key of a function, or None if it cannot be cached
+        """
+        fingerprint = get_function_fingerprint(func)
+        if fingerprint is None:
+            return None
+        inc_modules = None if include_modules is None else sorted(include_modules)
+        preinstalled_modules = sorted(name for name, _ in preinstalls)
+        filters = repr((inc_modules, sorted(exclude_modules), preinstalled_modules))
+        return '{}-{}'.format(fingerprint, hashlib.sha256(filters.encode()).hexdigest())
+
+    def get(self, key):
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self.dirty = True
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def dumps(self):
+        self.dirty = False
+        return pickle.dumps(self._entries, -1)
+
+    def loads(self, data):
+        """
+        Adds the entries of a dumped cache, keeping the local ones as the
+        most recently used
+        """
+        entries = pickle.loads(data)
+        entries.update(self._entries)
+        self._entries = entries
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+serialization_cache = SerializationCache()
+
+
+class _Unfingerprintable(Exception):
+    pass
+
+
+def get_function_fingerprint(func):
+    """
+    Returns a fingerprint of the code of a function, its defaults, its closure
+    and the globals it references, or None if some value cannot be fingerprinted
+    """
+    fingerprint = hashlib.sha256()
+    try:
+        _update_fingerprint(fingerprint, func, set())
+    except _Unfingerprintable:
+        return None
+    return fingerprint.hexdigest()
+
+
+def _get_code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(_get_code_names(const))
+    return names
+
+
+def _update_fingerprint(fingerprint, obj, seen):
+    def update(*values):
+        for value in values:
+            fingerprint.update(repr(value).encode())
+
+    if isinstance(obj, (type(None), bool, int, float, complex, str, bytes)):
+        update(type(obj).__name__, obj)
+    elif isinstance(obj, types.ModuleType):
+        update('module', obj.__name__)
+    elif isinstance(obj, types.CodeType):
+        update('code', obj.co_name, obj.co_code, obj.co_names, obj.co_varnames, obj.co_freevars)
+        for const in obj.co_consts:
+            _update_fingerprint(fingerprint, const, seen)
+    elif isinstance(obj, (tuple, list, set, frozenset)):
+        items = sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj
+        update(type(obj).__name__, len(items))
+        for item in items:
+            _update_fingerprint(fingerprint, item, seen)
+    elif isinstance(obj, dict):
+        update('dict', len(obj))
+        for key, value in obj.items():
+            _update_fingerprint(fingerprint, key, seen)
+            _update_fingerprint(fingerprint, value, seen)
+    elif id(obj) in seen:
+        update('seen', getattr(obj, '__qualname__', None))
+    elif isinstance(obj, types.FunctionType):
+        seen.add(id(obj))
+        update('function', obj.__module__, obj.__qualname__)
+        _update_fingerprint(fingerprint, obj.__code__, seen)
+        _update_fingerprint(fingerprint, obj.__defaults__, seen)
+        _update_fingerprint(fingerprint, obj.__kwdefaults__, seen)
+        for cell in obj.__closure__ or ():
+            try:
+                _update_fingerprint(fingerprint, cell.cell_contents, seen)
+            except ValueError:
+                update('empty cell')
+        for name in sorted(_get_code_names(obj.__code__)):
+            if name in obj.__globals__:
+                update(name)
+                _update_fingerprint(fingerprint, obj.__globals__[name], seen)
+    elif isinstance(obj, type) and obj.__module__ == '__main__':
+        # Classes of the main module are pickled by value
+        seen.add(id(obj))
+        update('class', obj.__qualname__)
+        _update_fingerprint(fingerprint, {k: v for k, v in vars(obj).items()
+                                          if isinstance(v, (types.FunctionType, staticmethod, classmethod))
+                                          or not k.startswith('__')}, seen)
+    elif isinstance(obj, (staticmethod, classmethod)):
+        _update_fingerprint(fingerprint, obj.__func__, seen)
+    elif isinstance(obj, (type, types.BuiltinFunctionType)):
+        update('ref', getattr(obj, '__module__', None), obj.__qualname__)
+    else:
+        try:
+            update(type(obj).__qualname__, hashlib.sha256(pickle.dumps(obj, -1)).hexdigest())
+        except Exception:
+            raise _Unfingerprintable()
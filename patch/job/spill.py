@@ -0,0 +1,88 @@
+#
+# (C) Copyright IBM Corp. 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pickle
+import logging
+from io import BytesIO as StringIO
+from lithops.constants import JOBS_PREFIX
+from lithops.storage.utils import create_job_key
+from lithops.libs.cloudpickle import CloudPickler
+from lithops.job.compression import compress, decompress
+
+logger = logging.getLogger(__name__)
+
+DATA_SPILL_SIZE = 1  # 1MiB
+
+
+def dumps(obj):
+    with StringIO() as file:
+        cp = CloudPickler(file)
+        cp.dump(obj)
+        return file.getvalue()
+
+
+class SpilledArgument:
+    """
+    Reference to a call argument stored in its own object
+    """
+    def __init__(self, key):
+        self.key = key
+
+
+def create_spill_key(executor_id, job_id, name):
+    return '/'.join([JOBS_PREFIX, create_job_key(executor_id, job_id), 'args', '{}.pickle'.format(name)])
+
+
+def put_argument(internal_storage, key, arg_str, codec=None):
+    if codec:
+        arg_str = compress(arg_str, codec)
+    internal_storage.put_data(key, arg_str)
+
+
+def get_argument(internal_storage, key, codec=None):
+    arg_str = internal_storage.get_data(key)
+    if codec:
+        arg_str = decompress(arg_str, codec)
+    return pickle.loads(arg_str)
+
+
+def spill_arguments(internal_storage, executor_id, job_id, call_id, data, spill_size, codec=None):
+    """
+    Uploads the arguments of a call bigger than spill_size bytes to their own
+    objects, and returns the call data serialized with references to them
+    """
+    spilled_data = {}
+    for name, value in data.items():
+        value_str = dumps(value)
+        if len(value_str) > spill_size:
+            key = create_spill_key(executor_id, job_id, '{}-{}'.format(call_id, name))
+            logger.debug('ExecutorID {} | JobID {} - Spilling argument {} of call {} to {}'
+                         .format(executor_id, job_id, name, call_id, key))
+            put_argument(internal_storage, key, value_str, codec)
+            spilled_data[name] = SpilledArgument(key)
+        else:
+            spilled_data[name] = value
+
+    return dumps(spilled_data)
+
+
+def resolve_arguments(internal_storage, data, codec=None):
+    """
+    Replaces the references to spilled arguments with their values
+    """
+    for name, value in data.items():
+        if isinstance(value, SpilledArgument):
+            data[name] = get_argument(internal_storage, value.key, codec)
@@ -0,0 +1,116 @@
+#
+# (C) Copyright IBM Corp. 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DATA_PART_SIZE = 8 * 1024**2
+DATA_UPLOAD_THREADS = 4
+
+
+class DataUploader:
+    """
+    Uploads the serialized data of a job as it is produced. Once a part of
+    DATA_PART_SIZE bytes is buffered, it is sent through a multipart upload
+    while the next one is serialized, so at most DATA_UPLOAD_THREADS parts are
+    kept in memory. Storage backends without multipart uploads get the whole
+    data in a single put at the end.
+    """
+    def __init__(self, internal_storage, key):
+        self.internal_storage = internal_storage
+        self.bucket = internal_storage.bucket
+        self.key = key
+        self.size = 0
+        self.ranges = []
+
+        self._buffer = []
+        self._buffer_size = 0
+        self._client = None
+        self._upload_id = None
+        self._multipart = None
+        self._parts = []
+        self._pool = None
+
+    def _start_multipart(self):
+        try:
+            self._client = self.internal_storage.storage.get_client()
+            upload = self._client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self._upload_id = upload['UploadId']
+            self._pool = ThreadPoolExecutor(DATA_UPLOAD_THREADS)
+            self._multipart = True
+        except Exception as e:
+            logger.debug('Multipart upload not available, the data will be '
+                         'uploaded at once: {}'.format(e))
+            self._multipart = False
+
+    def _upload_part(self, part_number, body):
+        res = self._client.upload_part(Bucket=self.bucket, Key=self.key, PartNumber=part_number,
+                                       UploadId=self._upload_id, Body=body)
+        return {'ETag': res['ETag'], 'PartNumber': part_number}
+
+    def _flush(self):
+        body = b''.join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        # Bounds the parts in flight, and so the memory in use
+        if len(self._parts) >= DATA_UPLOAD_THREADS:
+            self._parts[-DATA_UPLOAD_THREADS].result()
+        self._parts.append(self._pool.submit(self._upload_part, len(self._parts) + 1, body))
+
+    def write(self, data_str):
+        """
+        Appends the data of one call, and returns its byte range
+        """
+        data_range = (self.size, self.size+len(data_str)-1)
+        self.ranges.append(data_range)
+        self.size += len(data_str)
+        self._buffer.append(data_str)
+        self._buffer_size += len(data_str)
+
+        if self._buffer_size >= DATA_PART_SIZE:
+            if self._multipart is None:
+                self._start_multipart()
+            if self._multipart:
+                self._flush()
+
+        return data_range
+
+    def close(self):
+        """
+        Completes the upload, and returns the byte ranges of all the calls
+        """
+        if not self._multipart:
+            self.internal_storage.put_data(self.key, b''.join(self._buffer))
+            self._buffer = []
+            return self.ranges
+
+        if self._buffer:
+            self._flush()
+        parts = [part.result() for part in self._parts]
+        self._pool.shutdown()
+        self._client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                               MultipartUpload={'Parts': parts})
+        logger.debug('Data uploaded in {} parts to {}'.format(len(parts), self.key))
+
+        return self.ranges
+
+    def abort(self):
+        self._buffer = []
+        if self._multipart:
+            self._pool.shutdown()
+            self._client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
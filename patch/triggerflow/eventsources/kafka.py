@@ -1,33 +1,120 @@
 import os
 import time
 import json
+import uuid
 import logging
-from kafka import KafkaConsumer
+from kafka import KafkaConsumer, KafkaProducer, TopicPartition
+from kafka.partitioner.default import DefaultPartitioner
+
+from lithops.storage.utils import StorageNoSuchKeyError
+from lithops.triggerflow.snapshot import create_event_source_state_key
+from .utils import unpack_call_statuses
 
 logger = logging.getLogger(__name__)
 
+EVENTS_PAGE_SIZE = 1000
+POLL_TIMEOUT = 10000
+CLAIMS_TOPIC = 'lithops-kafka-claims'
+CLAIMS_CLOCK_SKEW = 60
+
 
 class KafkaEventSource:
-    def __init__(self, config):
+    def __init__(self, config, executor_id, cursor=None, internal_storage=None):
         self.config = config
+        self.executor_id = executor_id
+        self.internal_storage = internal_storage
+        self.topic = 'lithops-kafka-eventsource'
+        self._set_cursor(cursor)
+        self.page_size = config.get('page_size', EVENTS_PAGE_SIZE)
+        self.partitioned = config.get('partitioned', False)
 
-    def get_events(self):
-        if os.environ.get('LITHOPS_FIRST_EXEC') == 'False':
-            to = time.time()
-            consumer = KafkaConsumer('lithops-kafka-eventsource', bootstrap_servers=self.config['kafka']['broker_list'],
-                                     auto_offset_reset='earliest', enable_auto_commit=False)
-            logger.info('Downloading Events')
-            kafka_data = consumer.poll(timeout_ms=10000, max_records=10000)
-            records = []
+    def get_sink_data(self):
+        kafka_config = self.config.copy()
+        kafka_config['class'] = 'KafkaEventSource'
+        kafka_config['topic'] = self.topic
+        kafka_config['name'] = self.topic
+        if self.partitioned:
+            # Events keyed by executor land in a single partition of the topic
+            kafka_config['key'] = self.executor_id
+
+        return kafka_config
+
+    def _set_cursor(self, cursor):
+        # The cursor holds the offset to read next in each partition
+        self.cursor = cursor
+        self.offsets = {TopicPartition(self.topic, int(p)): o for p, o in (cursor or {}).items()}
+
+    def _load_state(self):
+        """
+        Loads the compacted state of this executor from the storage. The state
+        is only valid if it was built up to the same cursor received in the
+        invocation, otherwise the whole topic has to be read again.
+        """
+        if self.cursor and self.internal_storage:
+            try:
+                state = json.loads(self.internal_storage.get_data(create_event_source_state_key(self.executor_id)))
+                if state['cursor'] == self.cursor:
+                    return state['jobs']
+                logger.debug('Event sourcing - Stored state does not match cursor {}'.format(self.cursor))
+            except StorageNoSuchKeyError:
+                logger.debug('Event sourcing - Stored state not found')
+
+        self._set_cursor(None)
+        return {}
+
+    def _save_state(self, event_sourcing_jobs):
+        if self.internal_storage:
+            state = {'cursor': self.cursor, 'jobs': event_sourcing_jobs}
+            self.internal_storage.put_data(create_event_source_state_key(self.executor_id), json.dumps(state))
+
+    def _create_consumer(self):
+        """
+        Creates a consumer assigned to the partitions that hold the events of
+        this executor, positioned at the last read offsets if any
+        """
+        consumer = KafkaConsumer(bootstrap_servers=self.config['broker_list'],
+                                 auto_offset_reset='earliest', enable_auto_commit=False)
+        all_partitions = sorted(consumer.partitions_for_topic(self.topic) or [])
+        if self.partitioned and all_partitions:
+            all_partitions = [DefaultPartitioner()(self.executor_id.encode('utf-8'),
+                                                   all_partitions, all_partitions)]
+        partitions = [TopicPartition(self.topic, p) for p in all_partitions]
+        consumer.assign(partitions)
+        for tp in partitions:
+            if tp in self.offsets:
+                consumer.seek(tp, self.offsets[tp])
+            else:
+                consumer.seek_to_beginning(tp)
+
+        return consumer, partitions
+
+    def _update_cursor(self, consumer, partitions):
+        self.offsets = {tp: consumer.position(tp) for tp in partitions}
+        self.cursor = {str(tp.partition): offset for tp, offset in self.offsets.items()}
+
+    def _iter_event_pages(self):
+        """
+        Polls the topic in pages of 'page_size' records until the end offsets
+        taken at the beginning of the recovery are reached
+        """
+        consumer, partitions = self._create_consumer()
+        end_offsets = consumer.end_offsets(partitions)
+        pending = [tp for tp in partitions if consumer.position(tp) < end_offsets[tp]]
+
+        while pending:
+            kafka_data = consumer.poll(timeout_ms=POLL_TIMEOUT, max_records=self.page_size)
+            if not kafka_data:
+                logger.warning('Event sourcing - No events received in {}s before reaching the '
+                               'end of the topic'.format(POLL_TIMEOUT // 1000))
+                break
             for topic_partition in kafka_data:
-                records.extend(kafka_data[topic_partition])
-            logger.info('Events downloaded - TOTAL: {} - TIME: {}s'.format(len(records), round(time.time()-to, 3)))
-            if not records:
-                exit()
-        else:
-            records = []
+                yield kafka_data[topic_partition]
+            pending = [tp for tp in pending if consumer.position(tp) < end_offsets[tp]]
 
-        event_sourcing_jobs = {}
+        self._update_cursor(consumer, partitions)
+        consumer.close()
+
+    def _fold_events(self, event_sourcing_jobs, records):
         for record in records:
             event = json.loads(record.value.decode('utf-8'))
             if event['subject'].startswith(self.executor_id):
@@ -35,12 +122,160 @@ class KafkaEventSource:
                 data = json.loads(event['data'])
                 if job_id not in event_sourcing_jobs:
                     event_sourcing_jobs[job_id] = []
-                event_sourcing_jobs[job_id].append(data)
+                event_sourcing_jobs[job_id].extend(unpack_call_statuses(data))
 
-        kafka_config = self.config['kafka']
-        kafka_config['class'] = 'KafkaEventSource'
-        kafka_config['topic'] = 'lithops-kafka-eventsource'
-        kafka_config['name'] = 'lithops-kafka-eventsource'
-        os.environ['__OW_TF_SINK'] = json.dumps(kafka_config)
+    def get_events(self):
+        if os.environ.get('LITHOPS_FIRST_EXEC') == 'False':
+            to = time.time()
+            logger.info('Downloading Events')
+            event_sourcing_jobs = self._load_state()
+            total_records = 0
+            for page in self._iter_event_pages():
+                self._fold_events(event_sourcing_jobs, page)
+                total_records += len(page)
+            logger.info('Events downloaded - TOTAL: {} - TIME: {}s'.format(total_records, round(time.time()-to, 3)))
+            if not total_records and not event_sourcing_jobs:
+                exit()
+        else:
+            # Nothing to recover, the next wake only needs the events after this point
+            event_sourcing_jobs = {}
+            self._set_cursor(self.get_last_cursor())
+
+        self._save_state(event_sourcing_jobs)
 
         return event_sourcing_jobs
+
+    def wait_events(self, event_sourcing_jobs, jobs, timeout):
+        """
+        Polls the topic until the termination events of all the calls of the
+        jobs, given as {job_id: total_calls}, are received, or until the
+        timeout expires
+        """
+        consumer, partitions = self._create_consumer()
+        deadline = time.time() + timeout
+
+        def jobs_done():
+            return all(len(event_sourcing_jobs.get(job_id, [])) >= total_calls
+                       for job_id, total_calls in jobs.items())
+
+        while not jobs_done() and time.time() < deadline:
+            poll_timeout = max(int((deadline - time.time()) * 1000), 1)
+            kafka_data = consumer.poll(timeout_ms=poll_timeout, max_records=self.page_size)
+            for topic_partition in kafka_data:
+                self._fold_events(event_sourcing_jobs, kafka_data[topic_partition])
+
+        self._update_cursor(consumer, partitions)
+        consumer.close()
+
+        return jobs_done()
+
+    def save_state(self, event_sourcing_jobs):
+        """
+        Saves the state up to the current cursor, once this coordinator
+        continues the workflow from it
+        """
+        self._save_state(event_sourcing_jobs)
+
+    def claim(self, job_id, since=None):
+        """
+        Atomically claims the continuation of the workflow after job_id. Each
+        coordinator appends a claim record keyed by the job, and the first
+        record of the key in its partition wins. The claims are only read from
+        'since', the time the trigger of the job was added, as no coordinator
+        claims the job before.
+        """
+        key = '{}/{}'.format(self.executor_id, job_id).encode('utf-8')
+        token = uuid.uuid4().hex.encode('utf-8')
+        producer = KafkaProducer(bootstrap_servers=self.config['broker_list'])
+        metadata = producer.send(CLAIMS_TOPIC, key=key, value=token).get()
+        producer.close()
+
+        tp = TopicPartition(CLAIMS_TOPIC, metadata.partition)
+        consumer = KafkaConsumer(bootstrap_servers=self.config['broker_list'],
+                                 auto_offset_reset='earliest', enable_auto_commit=False)
+        consumer.assign([tp])
+        start = None
+        if since:
+            start = consumer.offsets_for_times({tp: int((since - CLAIMS_CLOCK_SKEW) * 1000)})[tp]
+        if start is not None:
+            consumer.seek(tp, start.offset)
+        else:
+            consumer.seek_to_beginning(tp)
+
+        # Our own claim is always found, so keep polling until it is reached
+        winner = None
+        while winner is None and consumer.position(tp) <= metadata.offset:
+            records = consumer.poll(timeout_ms=POLL_TIMEOUT, max_records=self.page_size).get(tp)
+            if not records:
+                logger.warning('Event sourcing - No claims received in {}s, retrying'
+                               .format(POLL_TIMEOUT // 1000))
+                continue
+            winner = next((r.value for r in records if r.key == key), None)
+        consumer.close()
+
+        return winner == token
+
+    def clean(self):
+        # The state is removed with the prefixes of the executor, and the
+        # claims and the events expire with the retention of their topics
+        pass
+
+    def stream_events(self, calls, timeout):
+        """
+        Yields the termination events of the given (job_id, call_id) calls as
+        they arrive after the cursor, until all of them are received or no
+        event arrives within the timeout
+        """
+        consumer, partitions = self._create_consumer()
+        pending = set(calls)
+
+        while pending:
+            kafka_data = consumer.poll(timeout_ms=int(timeout * 1000), max_records=self.page_size)
+            if not kafka_data:
+                break
+            for topic_partition in kafka_data:
+                for record in kafka_data[topic_partition]:
+                    event = json.loads(record.value.decode('utf-8'))
+                    if not event['subject'].startswith(self.executor_id):
+                        continue
+                    for data in unpack_call_statuses(json.loads(event['data'])):
+                        call = (data.get('job_id'), data.get('call_id'))
+                        if call in pending:
+                            pending.remove(call)
+                            yield data
+
+        self._update_cursor(consumer, partitions)
+        consumer.close()
+
+    def get_last_cursor(self):
+        """
+        Returns the end offsets of the partitions of this executor, from
+        which only the events that arrive from now on are read
+        """
+        consumer, partitions = self._create_consumer()
+        end_offsets = consumer.end_offsets(partitions)
+        consumer.close()
+
+        return {str(tp.partition): offset for tp, offset in end_offsets.items()}
+
+    def follow_events(self, timeout):
+        """
+        Yields the data of the termination events of this executor, one per
+        activation, as they arrive after the cursor. Yields None each time no
+        event arrives within the timeout.
+        """
+        consumer, partitions = self._create_consumer()
+
+        try:
+            while True:
+                kafka_data = consumer.poll(timeout_ms=int(timeout * 1000), max_records=self.page_size)
+                if not kafka_data:
+                    yield None
+                    continue
+                for topic_partition in kafka_data:
+                    for record in kafka_data[topic_partition]:
+                        event = json.loads(record.value.decode('utf-8'))
+                        if event['subject'].startswith(self.executor_id):
+                            yield json.loads(event['data'])
+        finally:
+            consumer.close()
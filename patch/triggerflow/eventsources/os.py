@@ -10,6 +10,7 @@ logger = logging.getLogger(__name__)
 class ObjectStorageEventSource:
     def __init__(self, config):
         self.config = config
+        self.cursor = None
 
     def get_events(self):
         if os.environ.get('LITHOPS_FIRST_EXEC') == 'False':
@@ -35,3 +36,17 @@ class ObjectStorageEventSource:
         os.environ['__OW_TF_SINK'] = json.dumps(redis_config)
 
         return event_sourcing_jobs
+
+    def wait_events(self, event_sourcing_jobs, jobs, timeout):
+        # Waiting in place is not supported, the coordinator always relies on the trigger
+        return False
+
+    def save_state(self, event_sourcing_jobs):
+        pass
+
+    def claim(self, job_id, since=None):
+        # Without warm coordinators, the trigger is the only one that continues the workflow
+        return True
+
+    def clean(self):
+        pass
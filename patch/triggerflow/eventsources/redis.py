@@ -4,18 +4,28 @@ import json
 import logging
 import redis
 
+from .utils import unpack_call_statuses
+
 logger = logging.getLogger(__name__)
 
+EVENTS_PAGE_SIZE = 1000
+CLAIMS_TTL = 24 * 3600
+
 
 class RedisEventSource:
-    def __init__(self, config, executor_id):
+    def __init__(self, config, executor_id, cursor=None):
         self.executor_id = executor_id
+        self.cursor = cursor
         self.stream = config['stream']
+        if config.get('partitioned', False):
+            # One stream per executor, so the recovery never reads other executors' events
+            self.stream = '{}:{}'.format(self.stream, self.executor_id)
         self.name = config['name']
         self.host = config['host']
         self.port = config['port']
         self.password = config['password']
         self.db = config['db']
+        self.page_size = config.get('page_size', EVENTS_PAGE_SIZE)
 
     def get_sink_data(self):
         redis_config = {}
@@ -30,28 +40,189 @@ class RedisEventSource:
 
         return redis_config
 
-    def get_events(self):
-        if os.environ.get('LITHOPS_FIRST_EXEC') == 'False':
-            logger.info('Event sourcing - Recovering events from redis stream: {}'.format(self.stream))
-            to = time.time()
-            redis_client = redis.StrictRedis(host=self.host, port=self.port,
-                                             db=self.db, password=self.password,
-                                             charset="utf-8",
-                                             decode_responses=True)
-            records = redis_client.xread({self.stream: '0'}, block=5)[0][1]
-            logger.info('Jobs downloaded - TOTAL: {} - TIME: {}s'.format(len(records), round(time.time()-to, 3)))
-            if not records:
-                exit()
-        else:
-            records = []
+    def _get_state_key(self):
+        return '{}/{}/state'.format(self.stream, self.executor_id)
+
+    def _load_state(self, redis_client):
+        """
+        Loads the compacted state of this executor. The state is only valid if
+        it was built up to the same cursor received in the invocation, otherwise
+        the whole stream has to be read again.
+        """
+        state = redis_client.get(self._get_state_key())
+        if state:
+            state = json.loads(state)
+            if self.cursor and state['cursor'] == self.cursor:
+                return state['jobs']
+            logger.debug('Event sourcing - Stored state does not match cursor {}'.format(self.cursor))
 
-        event_sourcing_jobs = {}
+        self.cursor = None
+        return {}
+
+    def _save_state(self, redis_client, event_sourcing_jobs):
+        state = {'cursor': self.cursor, 'jobs': event_sourcing_jobs}
+        redis_client.set(self._get_state_key(), json.dumps(state))
+
+    def _get_claims_key(self):
+        return '{}/{}/claims'.format(self.stream, self.executor_id)
+
+    def _get_last_event_id(self, redis_client):
+        last_event = redis_client.xrevrange(self.stream, count=1)
+        return last_event[0][0] if last_event else '0'
+
+    def _iter_event_pages(self, redis_client):
+        """
+        Reads the stream after the cursor in pages of 'page_size' events, so
+        that only one page is kept in memory at a time
+        """
+        start = self.cursor or '0'
+        while True:
+            if start != '0':
+                ms, seq = start.split('-')
+                start = '{}-{}'.format(ms, int(seq)+1)
+            page = redis_client.xrange(self.stream, min=start, max='+', count=self.page_size)
+            if not page:
+                break
+            yield page
+            if len(page) < self.page_size:
+                break
+            start = page[-1][0]
+
+    def _fold_events(self, event_sourcing_jobs, records):
         for e_id, event in records:
+            self.cursor = e_id
             if event['subject'].startswith(self.executor_id):
                 executor_id, job_id, fn = event['subject'].rsplit('/', 2)
                 data = json.loads(event['data'])
                 if job_id not in event_sourcing_jobs:
                     event_sourcing_jobs[job_id] = []
-                event_sourcing_jobs[job_id].append(data)
+                event_sourcing_jobs[job_id].extend(unpack_call_statuses(data))
+
+    def _get_redis_client(self):
+        return redis.StrictRedis(host=self.host, port=self.port,
+                                 db=self.db, password=self.password,
+                                 charset="utf-8",
+                                 decode_responses=True)
+
+    def get_events(self):
+        redis_client = self._get_redis_client()
+
+        if os.environ.get('LITHOPS_FIRST_EXEC') == 'False':
+            logger.info('Event sourcing - Recovering events from redis stream: {}'.format(self.stream))
+            to = time.time()
+            event_sourcing_jobs = self._load_state(redis_client)
+            total_records = 0
+            for page in self._iter_event_pages(redis_client):
+                self._fold_events(event_sourcing_jobs, page)
+                total_records += len(page)
+            logger.info('Jobs downloaded - TOTAL: {} - CURSOR: {} - TIME: {}s'
+                        .format(total_records, self.cursor, round(time.time()-to, 3)))
+            if not total_records and not event_sourcing_jobs:
+                exit()
+        else:
+            # Nothing to recover, the next wake only needs the events after this point
+            event_sourcing_jobs = {}
+            self.cursor = self._get_last_event_id(redis_client)
+
+        self._save_state(redis_client, event_sourcing_jobs)
 
         return event_sourcing_jobs
+
+    def wait_events(self, event_sourcing_jobs, jobs, timeout):
+        """
+        Blocks on the stream until the termination events of all the calls of
+        the jobs, given as {job_id: total_calls}, are received, or until the
+        timeout expires. The state is not saved, as the trigger of the jobs
+        still holds the previous cursor.
+        """
+        redis_client = self._get_redis_client()
+        deadline = time.time() + timeout
+
+        def jobs_done():
+            return all(len(event_sourcing_jobs.get(job_id, [])) >= total_calls
+                       for job_id, total_calls in jobs.items())
+
+        while not jobs_done() and time.time() < deadline:
+            block = max(int((deadline - time.time()) * 1000), 1)
+            response = redis_client.xread({self.stream: self.cursor or '0'},
+                                          count=self.page_size, block=block)
+            if response:
+                self._fold_events(event_sourcing_jobs, response[0][1])
+
+        return jobs_done()
+
+    def save_state(self, event_sourcing_jobs):
+        """
+        Saves the state up to the current cursor, once this coordinator
+        continues the workflow from it
+        """
+        self._save_state(self._get_redis_client(), event_sourcing_jobs)
+
+    def claim(self, job_id, since=None):
+        """
+        Atomically claims the continuation of the workflow after job_id. Only
+        the first of the coordinators that wait for the job gets it. The
+        claims are never cleaned, as a late coordinator could claim again, so
+        they expire CLAIMS_TTL seconds after the last one.
+        """
+        pipe = self._get_redis_client().pipeline()
+        pipe.hsetnx(self._get_claims_key(), job_id, 1)
+        pipe.expire(self._get_claims_key(), CLAIMS_TTL)
+        claimed, _ = pipe.execute()
+        return bool(claimed)
+
+    def clean(self):
+        """
+        Deletes the state of this executor
+        """
+        self._get_redis_client().delete(self._get_state_key())
+
+    def stream_events(self, calls, timeout):
+        """
+        Yields the termination events of the given (job_id, call_id) calls as
+        they arrive after the cursor, until all of them are received or no
+        event arrives within the timeout
+        """
+        redis_client = self._get_redis_client()
+        pending = set(calls)
+
+        while pending:
+            response = redis_client.xread({self.stream: self.cursor or '0'},
+                                          count=self.page_size, block=int(timeout * 1000))
+            if not response:
+                break
+            for e_id, event in response[0][1]:
+                self.cursor = e_id
+                if not event['subject'].startswith(self.executor_id):
+                    continue
+                for data in unpack_call_statuses(json.loads(event['data'])):
+                    call = (data.get('job_id'), data.get('call_id'))
+                    if call in pending:
+                        pending.remove(call)
+                        yield data
+
+    def get_last_cursor(self):
+        """
+        Returns the cursor of the last event of the stream, from which only
+        the events that arrive from now on are read
+        """
+        return self._get_last_event_id(self._get_redis_client())
+
+    def follow_events(self, timeout):
+        """
+        Yields the data of the termination events of this executor, one per
+        activation, as they arrive after the cursor. Yields None each time no
+        event arrives within the timeout.
+        """
+        redis_client = self._get_redis_client()
+
+        while True:
+            response = redis_client.xread({self.stream: self.cursor or '0'},
+                                          count=self.page_size, block=int(timeout * 1000))
+            if not response:
+                yield None
+                continue
+            for e_id, event in response[0][1]:
+                self.cursor = e_id
+                if event['subject'].startswith(self.executor_id):
+                    yield json.loads(event['data'])
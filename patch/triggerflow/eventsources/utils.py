@@ -0,0 +1,7 @@
+def unpack_call_statuses(data):
+    """
+    Returns the statuses of all the calls run by the activation that sent a
+    termination event. A batch activation sends the status of its first
+    call, that holds the statuses of the rest of the batch.
+    """
+    return [data] + data.pop('batch', [])
@@ -0,0 +1,118 @@
+import copy
+import time
+import pickle
+import logging
+from collections.abc import Iterator
+
+from lithops.wait import wait_storage
+from lithops.future import ResponseFuture
+from lithops.utils import b64str_to_bytes
+from lithops.storage.utils import create_job_key
+from lithops.job.compression import decompress
+from lithops.triggerflow.eventsources import KafkaEventSource, RedisEventSource
+
+logger = logging.getLogger(__name__)
+
+STREAM_IDLE_TIMEOUT = 30
+
+
+def set_call_status(f, call_status, internal_storage, throw_except=True):
+    """
+    Sets the status received in a termination event into a future. The
+    result is taken from the event when the worker inlined it, otherwise
+    it is downloaded from the storage
+    """
+    f._call_status = call_status
+    if 'result_inline' in call_status:
+        f.status(throw_except=throw_except, internal_storage=internal_storage)
+        if f._state == ResponseFuture.State.Ready:
+            pickled_output = b64str_to_bytes(call_status['result_inline'])
+            if 'result_codec' in call_status:
+                pickled_output = decompress(pickled_output, call_status['result_codec'])
+            f._return_val = pickle.loads(pickled_output)['result']
+            f.stats['host_result_done_tstamp'] = time.time()
+            f._set_state(ResponseFuture.State.Success)
+    else:
+        f.result(throw_except=throw_except, internal_storage=internal_storage)
+
+
+def create_future_reference(f):
+    """
+    Returns a copy of a future without its result, so passing it to a
+    function only costs its ids. The function downloads the result from
+    the storage, or waits for it if the call is not done yet.
+    """
+    ref = copy.copy(f)
+    ref.stats = {}
+    ref._return_val = None
+    ref._call_output = None
+    ref._new_futures = None
+    if f._call_status is not None:
+        ref._call_status = {k: v for k, v in f._call_status.items() if k != 'result_inline'}
+    if f._state == ResponseFuture.State.Success and f._produce_output:
+        ref._set_state(ResponseFuture.State.Ready)
+
+    return ref
+
+
+def reference_futures(iterdata, cleaned_jobs=()):
+    """
+    Replaces the futures in the elements of an iterdata with references. The
+    futures of jobs whose data was already cleaned keep their results.
+    Iterators are replaced lazily.
+    """
+    if type(iterdata) != list and not isinstance(iterdata, Iterator):
+        return iterdata
+
+    def reference(value):
+        if not isinstance(value, ResponseFuture):
+            return value
+        if create_job_key(value.executor_id, value.job_id) in cleaned_jobs:
+            return value
+        return create_future_reference(value)
+
+    def reference_element(data_i):
+        if type(data_i) is tuple:
+            return tuple(reference(value) for value in data_i)
+        elif type(data_i) is dict:
+            return {key: reference(value) for key, value in data_i.items()}
+        return reference(data_i)
+
+    if isinstance(iterdata, Iterator):
+        return (reference_element(data_i) for data_i in iterdata)
+    return [reference_element(data_i) for data_i in iterdata]
+
+
+def stream_results(futures, config, internal_storage, cursor):
+    """
+    Yields the results of the futures in completion order, as their termination
+    events arrive to the Triggerflow sink after the cursor. The futures whose
+    event is not received within STREAM_IDLE_TIMEOUT are waited in the storage
+    """
+    pending = {(f.job_id, f.call_id): f for f in futures}
+    executor_id = futures[0].executor_id if futures else None
+
+    sink = config['triggerflow']['sink']
+    if sink == 'kafka':
+        event_source = KafkaEventSource(config['kafka'], executor_id, cursor)
+    elif sink == 'redis':
+        event_source = RedisEventSource(config['redis'], executor_id, cursor)
+    else:
+        logger.warning('Streaming results is not supported by the {} sink'.format(sink))
+        event_source = None
+
+    if event_source:
+        for call_status in event_source.stream_events(list(pending), STREAM_IDLE_TIMEOUT):
+            f = pending.pop((call_status['job_id'], call_status['call_id']))
+            set_call_status(f, call_status, internal_storage)
+            if f.done and not f.futures:
+                yield f.result(internal_storage=internal_storage)
+
+    if pending:
+        logger.info('{} results not received through the sink, waiting for them '
+                    'in the storage'.format(len(pending)))
+        fs = list(pending.values())
+        wait_storage(fs, internal_storage, download_results=True)
+        for f in fs:
+            if f.done and not f.futures:
+                yield f.result(internal_storage=internal_storage)
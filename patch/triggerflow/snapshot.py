@@ -0,0 +1,85 @@
+import pickle
+import logging
+
+from lithops.storage.utils import StorageNoSuchKeyError
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_PREFIX = 'lithops.triggerflow/snapshots'
+SERIALIZATION_CACHE_PREFIX = 'lithops.triggerflow/serialization'
+EVENT_SOURCE_STATE_PREFIX = 'lithops.triggerflow/state'
+
+
+def create_snapshots_prefix(executor_id):
+    return '/'.join([SNAPSHOTS_PREFIX, executor_id]) + '/'
+
+
+def create_snapshot_key(executor_id, job_id):
+    return create_snapshots_prefix(executor_id) + '{}.pickle'.format(job_id)
+
+
+def create_serialization_cache_key(executor_id):
+    return '/'.join([SERIALIZATION_CACHE_PREFIX, '{}.pickle'.format(executor_id)])
+
+
+def create_event_source_state_key(executor_id):
+    return '/'.join([EVENT_SOURCE_STATE_PREFIX, '{}.json'.format(executor_id)])
+
+
+def create_executor_prefixes(executor_id):
+    """
+    Returns the prefixes of all the Triggerflow objects of an executor
+    """
+    return [create_snapshots_prefix(executor_id),
+            create_serialization_cache_key(executor_id),
+            create_event_source_state_key(executor_id)]
+
+
+def put_snapshot(internal_storage, executor_id, job_id, jobs, previous_job_id=None):
+    """
+    Stores the futures of all the jobs completed up to job_id, with their
+    results already materialized. The snapshot is keyed by job_id, so a late
+    wake never reads a snapshot newer than its trigger. As it holds all the
+    previous jobs, the snapshot of previous_job_id is deleted.
+    """
+    try:
+        snapshot = pickle.dumps({'job_id': job_id, 'jobs': jobs})
+    except Exception as e:
+        logger.warning('ExecutorID {} | JobID {} - Unable to create the snapshot: {}'
+                       .format(executor_id, job_id, e))
+        return None
+    internal_storage.put_data(create_snapshot_key(executor_id, job_id), snapshot)
+    logger.info('ExecutorID {} | JobID {} - Snapshot stored - Jobs: {}'
+                .format(executor_id, job_id, len(jobs)))
+    if previous_job_id and previous_job_id != job_id:
+        internal_storage.storage.delete_object(internal_storage.bucket,
+                                               create_snapshot_key(executor_id, previous_job_id))
+
+    return job_id
+
+
+def get_snapshot(internal_storage, executor_id, job_id):
+    try:
+        snapshot = pickle.loads(internal_storage.get_data(create_snapshot_key(executor_id, job_id)))
+    except StorageNoSuchKeyError:
+        logger.info('ExecutorID {} | JobID {} - Snapshot not found'.format(executor_id, job_id))
+        return None
+    logger.info('ExecutorID {} | JobID {} - Snapshot recovered - Jobs: {}'
+                .format(executor_id, snapshot['job_id'], len(snapshot['jobs'])))
+
+    return snapshot
+
+
+def put_serialization_cache(internal_storage, executor_id, serialization_cache):
+    """
+    Stores the serialized functions of this coordinator, so the next wake
+    does not need to walk their module dependencies again
+    """
+    internal_storage.put_data(create_serialization_cache_key(executor_id), serialization_cache.dumps())
+
+
+def get_serialization_cache(internal_storage, executor_id, serialization_cache):
+    try:
+        serialization_cache.loads(internal_storage.get_data(create_serialization_cache_key(executor_id)))
+    except StorageNoSuchKeyError:
+        logger.debug('ExecutorID {} - Serialization cache not found'.format(executor_id))
@@ -1,18 +1,24 @@
 import os
 import sys
+import hashlib
 import logging
 import inspect
 import zipfile
+import tempfile
 
 import lithops
 from lithops.libs.openwhisk.client import OpenWhiskClient
 from lithops.utils import create_executor_id
 from lithops.config import default_config
+from lithops.constants import CACHE_DIR, SERVERLESS, STANDALONE, \
+    SERVERLESS_BACKEND_DEFAULT, STANDALONE_BACKEND_DEFAULT, STORAGE_BACKEND_DEFAULT
 
 logger = logging.getLogger(__name__)
 
 
-FH_ZIP_LOCATION = os.path.join(os.getcwd(), 'lithops_ibmcf.zip')
+FH_ZIP_CACHE_DIR = os.path.join(CACHE_DIR, 'triggerflow')
+FH_ZIP_CACHE_SIZE = 10
+CODE_HASH_ANNOTATION = 'lithops_code_hash'
 RUNTIME_DEFAULT = {'3.6': 'triggerflow/ibm_cloud_functions_runtime-v36',
                    '3.7': 'triggerflow/ibm_cloud_functions_runtime-v37',
                    '3.8': 'triggerflow/ibm_cloud_functions_runtime-v38'}
@@ -39,28 +45,123 @@ class TriggerflowExecutor:
         self.default_runtime = RUNTIME_DEFAULT[python_version]
         logger.info('TriggerflowExecutor created')
 
-    def _create_function_handler_zip(self, main_exec_file):
-
-        logger.debug("Creating function handler zip in {}".format(FH_ZIP_LOCATION))
+    def _get_excluded_paths(self):
+        """
+        Returns the paths of the lithops package the coordinator never imports:
+        the cli and the compute and storage backends it is not configured with
+        """
+        lithops_config = self.config.get('lithops', {})
+        mode = lithops_config.get('mode', SERVERLESS)
+        backends = {'serverless': None, 'standalone': None,
+                    'storage': lithops_config.get('storage', STORAGE_BACKEND_DEFAULT)}
+        if mode == SERVERLESS:
+            backends['serverless'] = self.config.get(SERVERLESS, {}).get('backend', SERVERLESS_BACKEND_DEFAULT)
+        elif mode == STANDALONE:
+            backends['standalone'] = self.config.get(STANDALONE, {}).get('backend', STANDALONE_BACKEND_DEFAULT)
+
+        module_location = os.path.dirname(os.path.abspath(lithops.__file__))
+        excluded_paths = {os.path.join(module_location, 'cli'),
+                          os.path.join(module_location, 'tests.py')}
+        for package, backend in backends.items():
+            backends_dir = os.path.join(module_location, package, 'backends')
+            if not os.path.isdir(backends_dir):
+                continue
+            for file in os.listdir(backends_dir):
+                full_path = os.path.join(backends_dir, file)
+                if os.path.isdir(full_path) and file != backend:
+                    excluded_paths.add(full_path)
+
+        return excluded_paths
+
+    def _get_package_files(self, main_exec_file):
+        """
+        Returns the (path, archive name) of every file to add to the coordinator package
+        """
+        excluded_paths = self._get_excluded_paths()
+        files = [(main_exec_file, '__main__.py')]
 
-        def add_folder_to_zip(zip_file, full_dir_path, sub_dir=''):
-            for file in os.listdir(full_dir_path):
+        def add_folder(full_dir_path, sub_dir=''):
+            for file in sorted(os.listdir(full_dir_path)):
                 full_path = os.path.join(full_dir_path, file)
+                if full_path in excluded_paths:
+                    continue
                 if os.path.isfile(full_path):
-                    zip_file.write(full_path, os.path.join('lithops', sub_dir, file))
+                    files.append((full_path, os.path.join('lithops', sub_dir, file)))
                 elif os.path.isdir(full_path) and '__pycache__' not in full_path:
-                    add_folder_to_zip(zip_file, full_path, os.path.join(sub_dir, file))
+                    add_folder(full_path, os.path.join(sub_dir, file))
+
+        add_folder(os.path.dirname(os.path.abspath(lithops.__file__)))
+
+        return files
+
+    def _get_code_hash(self, package_files, runtime):
+        code_hash = hashlib.sha256()
+        code_hash.update('{}:{}:{}'.format(runtime, MAIN_FN_MEMORY, MAIN_FN_TIMEOUT).encode())
+        for full_path, arcname in package_files:
+            code_hash.update(arcname.encode())
+            with open(full_path, 'rb') as f:
+                code_hash.update(f.read())
+
+        return code_hash.hexdigest()
 
+    def _create_function_handler_zip(self, package_files, code_hash):
+        """
+        Creates the coordinator package, or reuses the one cached for the same code hash
+        """
+        zip_location = os.path.join(FH_ZIP_CACHE_DIR, '{}.zip'.format(code_hash))
+        if os.path.exists(zip_location):
+            logger.debug("Using cached function handler zip {}".format(zip_location))
+            os.utime(zip_location)
+            return zip_location
+
+        logger.debug("Creating function handler zip in {}".format(zip_location))
+
+        # Each run builds its own temporary zip, which atomically replaces the
+        # cached one, so concurrent runs never read a partial package
+        os.makedirs(FH_ZIP_CACHE_DIR, exist_ok=True)
+        fd, tmp_location = tempfile.mkstemp(suffix='.tmp', dir=FH_ZIP_CACHE_DIR)
         try:
-            with zipfile.ZipFile(FH_ZIP_LOCATION, 'w', zipfile.ZIP_DEFLATED) as pywren_zip:
-                module_location = os.path.dirname(os.path.abspath(lithops.__file__))
-                pywren_zip.write(main_exec_file, '__main__.py')
-                add_folder_to_zip(pywren_zip, module_location)
-        except Exception:
-            raise Exception('Unable to create the {} package: {}'.format(FH_ZIP_LOCATION))
+            with os.fdopen(fd, 'wb') as tmp_zip:
+                with zipfile.ZipFile(tmp_zip, 'w', zipfile.ZIP_DEFLATED) as pywren_zip:
+                    for full_path, arcname in package_files:
+                        pywren_zip.write(full_path, arcname)
+            os.replace(tmp_location, zip_location)
+        except Exception as e:
+            if os.path.exists(tmp_location):
+                os.remove(tmp_location)
+            raise Exception('Unable to create the {} package: {}'.format(zip_location, e))
+
+        self._evict_function_handler_zips()
+
+        return zip_location
 
-    def _delete_function_handler_zip(self):
-        os.remove(FH_ZIP_LOCATION)
+    def _evict_function_handler_zips(self):
+        """
+        Keeps only the FH_ZIP_CACHE_SIZE most recently used coordinator packages
+        """
+        zips = []
+        for entry in os.scandir(FH_ZIP_CACHE_DIR):
+            if entry.name.endswith('.zip'):
+                try:
+                    zips.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        for _, path in sorted(zips, reverse=True)[FH_ZIP_CACHE_SIZE:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _get_deployed_annotations(self, name):
+        """
+        Returns the annotations of the deployed coordinator action, without its code
+        """
+        url = '/'.join([self.ow_client.endpoint, 'api', 'v1', 'namespaces', self.ow_client.namespace,
+                        'actions', 'triggerflow', name + '?code=false'])
+        res = self.ow_client.session.get(url)
+        if res.status_code != 200:
+            return []
+        return res.json().get('annotations', [])
 
     def run(self, coordinator_function, name, runtime=None):
         assert coordinator_function.__name__ == 'main', "Coordinator Function must have 'main' name"
@@ -68,16 +169,28 @@ class TriggerflowExecutor:
         file_path = os.path.abspath(inspect.getfile(coordinator_function))
         runtime = runtime or self.default_runtime
 
-        self._create_function_handler_zip(file_path)
-        with open(FH_ZIP_LOCATION, "rb") as action_zip:
-            action_bin = action_zip.read()
-            self.ow_client.create_action('triggerflow', name,
-                                         image_name=runtime,
-                                         code=action_bin,
-                                         memory=MAIN_FN_MEMORY,
-                                         is_binary=True,
-                                         timeout=MAIN_FN_TIMEOUT*1000)
-        self._delete_function_handler_zip()
+        package_files = self._get_package_files(file_path)
+        code_hash = self._get_code_hash(package_files, runtime)
+
+        annotations = self._get_deployed_annotations(name)
+        deployed_code_hash = {a['key']: a['value'] for a in annotations}.get(CODE_HASH_ANNOTATION)
+
+        if deployed_code_hash == code_hash:
+            logger.info('Coordinator function {} is up to date'.format(name))
+        else:
+            # The code hash is stored in the same request as the code, keeping the other annotations
+            annotations = [a for a in annotations if a['key'] != CODE_HASH_ANNOTATION]
+            annotations.append({'key': CODE_HASH_ANNOTATION, 'value': code_hash})
+            zip_location = self._create_function_handler_zip(package_files, code_hash)
+            with open(zip_location, "rb") as action_zip:
+                action_bin = action_zip.read()
+                self.ow_client.create_action('triggerflow', name,
+                                             image_name=runtime,
+                                             code=action_bin,
+                                             memory=MAIN_FN_MEMORY,
+                                             is_binary=True,
+                                             timeout=MAIN_FN_TIMEOUT*1000,
+                                             annotations=annotations)
 
         payload = {'config': self.config, 'execution_id': None, 'start_time': 0, 'runtime': runtime}
         self.ow_client.invoke('triggerflow', name, payload)
@@ -0,0 +1,108 @@
+from lithops.concurrency import ConcurrencyController, MIN_LATENCY_WINDOW
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def invoke(concurrency, rejected=False, latency=0.1):
+    assert concurrency.try_acquire()
+    concurrency.release(rejected, latency)
+
+
+def test_accepted_invocations_grow_the_limit_by_one_per_round():
+    concurrency = ConcurrencyController(initial_limit=10, clock=FakeClock())
+    for _ in range(11):
+        invoke(concurrency)
+    assert concurrency.metrics()['limit'] == 11
+
+
+def test_limit_is_enforced():
+    concurrency = ConcurrencyController(initial_limit=2, clock=FakeClock())
+    assert concurrency.try_acquire()
+    assert concurrency.try_acquire()
+    assert not concurrency.try_acquire()
+    concurrency.release(False, 0.1)
+    assert concurrency.try_acquire()
+
+
+def test_rejections_halve_the_limit_once_per_round_trip():
+    clock = FakeClock()
+    concurrency = ConcurrencyController(initial_limit=40, clock=clock)
+    invoke(concurrency, rejected=True)
+    assert concurrency.metrics()['limit'] == 20
+
+    # The rest of the calls rejected within the same round trip
+    for _ in range(5):
+        invoke(concurrency, rejected=True)
+    assert concurrency.metrics()['limit'] == 20
+
+    clock.advance(1)
+    invoke(concurrency, rejected=True)
+    assert concurrency.metrics()['limit'] == 10
+    assert concurrency.metrics()['rejections'] == 7
+
+
+def test_limit_stays_within_bounds():
+    clock = FakeClock()
+    concurrency = ConcurrencyController(initial_limit=4, min_limit=2, max_limit=5, clock=clock)
+    for _ in range(5):
+        clock.advance(1)
+        invoke(concurrency, rejected=True)
+    assert concurrency.metrics()['limit'] == 2
+
+    for _ in range(100):
+        invoke(concurrency)
+    assert concurrency.metrics()['limit'] == 5
+
+
+def test_latency_increase_halves_the_limit():
+    clock = FakeClock()
+    concurrency = ConcurrencyController(initial_limit=40, clock=clock)
+    for _ in range(10):
+        invoke(concurrency, latency=0.1)
+    limit = concurrency.metrics()['limit']
+
+    for _ in range(100):
+        clock.advance(0.01)
+        invoke(concurrency, latency=1)
+    assert concurrency.metrics()['limit'] < limit
+
+
+def test_min_latency_follows_a_slower_backend():
+    clock = FakeClock()
+    concurrency = ConcurrencyController(initial_limit=10, clock=clock)
+    for _ in range(10):
+        invoke(concurrency, latency=0.1)
+
+    # The backend becomes slower for good, which is congestion at first
+    for _ in range(100):
+        clock.advance(0.1)
+        invoke(concurrency, latency=1)
+    assert concurrency.metrics()['limit'] == 1
+
+    # Once the fast invocations leave the window, the limit grows again
+    for _ in range(int(2 * MIN_LATENCY_WINDOW / 0.1)):
+        clock.advance(0.1)
+        invoke(concurrency, latency=1)
+    assert concurrency.metrics()['limit'] > 1
+
+
+def test_min_latency_window_after_idle_time():
+    clock = FakeClock()
+    concurrency = ConcurrencyController(initial_limit=10, clock=clock)
+    for _ in range(10):
+        invoke(concurrency, latency=0.1)
+
+    clock.advance(2 * MIN_LATENCY_WINDOW)
+    for _ in range(10):
+        clock.advance(0.1)
+        invoke(concurrency, latency=1)
+    assert concurrency.metrics()['limit'] >= 10